@@ -0,0 +1,278 @@
+"""
+Benchmarks DatabaseUtils and Rule34DatabaseUtils against a synthetic dataset,
+every operation is measured with cold caches and again with warm caches
+
+    uv run benchmarks/db_utils.py --guilds 100000 --members 20 --db bench.db
+
+Seeding production scale data takes a while, pass --db to keep the seeded
+database around and --reuse to benchmark it again without reseeding.
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Tuple
+from uuid import uuid4
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from sqlalchemy import insert
+
+import db.engine
+from cogs.rule34.utils import Rule34DatabaseUtils
+from db.engine import init_db
+from db.models import (
+    CommandCategory,
+    Guild,
+    GuildUserProfile,
+    R34UserBlacklist,
+    R34UserBookmarks,
+    R34UserProfile,
+    User,
+    UserCommandCount,
+    now,
+)
+from db.utils import DatabaseUtils
+from utils.cache import CACHE_REGISTRY
+
+SEED_BATCH_SIZE = 20_000
+
+Operation = Callable[[str, str, int], Awaitable[Any]]
+
+
+def member_id(args: argparse.Namespace, guild: int, member: int) -> str:
+    return f"u{(guild * args.members + member) % args.users}"
+
+
+def seed_rows(args: argparse.Namespace) -> Iterator[Tuple[Any, List[Dict[str, Any]]]]:
+    """
+    Yields (table, rows) batches, parents always come before their children
+    """
+
+    rng = random.Random(args.seed)
+    created_at = now()
+
+    for start in range(0, args.users, SEED_BATCH_SIZE):
+        end = min(start + SEED_BATCH_SIZE, args.users)
+        yield User, [{"id": f"u{i}"} for i in range(start, end)]
+
+    for start in range(0, args.guilds, SEED_BATCH_SIZE):
+        end = min(start + SEED_BATCH_SIZE, args.guilds)
+        yield Guild, [
+            {"id": f"g{i}", "r34_enabled": True, "created_at": created_at}
+            for i in range(start, end)
+        ]
+
+    guilds_per_batch = max(1, SEED_BATCH_SIZE // args.members)
+    for start in range(0, args.guilds, guilds_per_batch):
+        profiles, r34_profiles, counts, blacklist, bookmarks = [], [], [], [], []
+
+        for guild in range(start, min(start + guilds_per_batch, args.guilds)):
+            for member in range(args.members):
+                profile_id = uuid4()
+                profiles.append(
+                    {
+                        "id": profile_id,
+                        "guild_id": f"g{guild}",
+                        "user_id": member_id(args, guild, member),
+                        "created_at": created_at,
+                    }
+                )
+                r34_profiles.append({"user_id": profile_id, "blacklist_enabled": True})
+                counts.append(
+                    {
+                        "user_id": profile_id,
+                        "category": CommandCategory.RULE34,
+                        "count": rng.randrange(1000),
+                    }
+                )
+
+                if rng.random() < args.blacklist_share:
+                    blacklist.extend(
+                        {"user_id": profile_id, "tag": f"tag_{i}"}
+                        for i in rng.sample(range(args.vocabulary), args.blacklist)
+                    )
+                if rng.random() < args.bookmark_share:
+                    bookmarks.extend(
+                        {
+                            "user_id": profile_id,
+                            "post_id": str(post_id),
+                            "created_at": created_at,
+                        }
+                        for post_id in rng.sample(range(10_000_000), args.bookmarks)
+                    )
+
+        yield GuildUserProfile, profiles
+        yield R34UserProfile, r34_profiles
+        yield UserCommandCount, counts
+        for table, rows in (
+            (R34UserBlacklist, blacklist),
+            (R34UserBookmarks, bookmarks),
+        ):
+            for i in range(0, len(rows), SEED_BATCH_SIZE):
+                yield table, rows[i : i + SEED_BATCH_SIZE]
+
+
+async def seed(args: argparse.Namespace) -> None:
+    start = time.perf_counter()
+    totals: Dict[str, int] = {}
+
+    async with db.engine.engine.begin() as conn:
+        for table, rows in seed_rows(args):
+            if rows:
+                await conn.execute(insert(table), rows)
+                totals[table.__name__] = totals.get(table.__name__, 0) + len(rows)
+
+    summary = ", ".join(f"{count} {name}" for name, count in totals.items())
+    print(f"seeded {summary} in {time.perf_counter() - start:.1f}s\n")
+
+
+def clear_caches() -> None:
+    for cache in CACHE_REGISTRY.values():
+        cache.clear()  # type: ignore[attr-defined]
+
+
+async def measure(
+    operation: Operation, keys: List[Tuple[str, str]], concurrency: int
+) -> Tuple[float, List[float]]:
+    latencies: List[float] = []
+    pending = iter(enumerate(keys))
+
+    async def worker() -> None:
+        for i, (guild_id, user_id) in pending:
+            start = time.perf_counter()
+            await operation(guild_id, user_id, i)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return elapsed, latencies
+
+
+def report(name: str, state: str, elapsed: float, latencies: List[float]) -> None:
+    def percentile(q: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q / 100))] * 1000
+
+    print(
+        f"{name:<28} {state:<5} {len(latencies) / elapsed:>9.0f} ops/s  "
+        f"p50 {percentile(50):>7.2f}ms  p95 {percentile(95):>7.2f}ms  "
+        f"p99 {percentile(99):>7.2f}ms"
+    )
+
+
+def operations(state: List[str]) -> Dict[str, Operation]:
+    """
+    Operations keyed by name. Written values depend on the cache state being
+    measured, so every add inserts new rows and the matching remove deletes them
+    """
+
+    def tags(i: int) -> List[str]:
+        return [f"bench_{state[0]}_{i}_{j}" for j in range(10)]
+
+    def post_ids(i: int) -> List[str]:
+        return [f"bench_{state[0]}_{i}_{j}" for j in range(10)]
+
+    async def flush_increments(guild_id: str, user_id: str, i: int) -> None:
+        await DatabaseUtils.increment_command_count(
+            guild_id, user_id, CommandCategory.RULE34
+        )
+        await DatabaseUtils.flush_command_counts()
+
+    return {
+        "register": lambda g, u, i: DatabaseUtils.register(g, u),
+        "fetch_or_create_guild": lambda g, u, i: DatabaseUtils.fetch_or_create_guild(g),
+        "fetch_or_create_profile": lambda g, u, i: (
+            DatabaseUtils.fetch_or_create_guild_user_profile(g, u)
+        ),
+        "fetch_or_create_r34_profile": lambda g, u, i: (
+            Rule34DatabaseUtils.fetch_or_create_r34_user_profile(g, u)
+        ),
+        "increment_command_count": lambda g, u, i: (
+            DatabaseUtils.increment_command_count(g, u, CommandCategory.RULE34)
+        ),
+        "increment_and_flush": flush_increments,
+        "fetch_command_count": lambda g, u, i: DatabaseUtils.fetch_command_count(
+            g, u, CommandCategory.RULE34
+        ),
+        "get_blacklist": lambda g, u, i: Rule34DatabaseUtils.get_blacklist(g, u),
+        "add_blacklist_tags": lambda g, u, i: Rule34DatabaseUtils.add_blacklist_tags(
+            g, u, tags(i)
+        ),
+        "remove_blacklist_tags": lambda g, u, i: (
+            Rule34DatabaseUtils.remove_blacklist_tags(g, u, tags(i))
+        ),
+        "get_bookmarks": lambda g, u, i: Rule34DatabaseUtils.get_bookmarks(g, u),
+        "add_bookmarks": lambda g, u, i: Rule34DatabaseUtils.add_bookmarks(
+            g, u, post_ids(i)
+        ),
+        "remove_bookmarks": lambda g, u, i: Rule34DatabaseUtils.remove_bookmarks(
+            g, u, post_ids(i)
+        ),
+    }
+
+
+async def run(args: argparse.Namespace, path: Path) -> None:
+    if not (args.reuse and path.exists()):
+        path.unlink(missing_ok=True)
+        await init_db(args.db_profile, path)
+        await seed(args)
+    else:
+        await init_db(args.db_profile, path)
+
+    rng = random.Random(args.seed + 1)
+    keys = []
+    for _ in range(args.samples):
+        guild = rng.randrange(args.guilds)
+        keys.append((f"g{guild}", member_id(args, guild, rng.randrange(args.members))))
+
+    current_state = [""]
+    for name, operation in operations(current_state).items():
+        if args.only and name not in args.only:
+            continue
+
+        clear_caches()
+        for state in ("cold", "warm"):
+            current_state[0] = state
+            elapsed, latencies = await measure(operation, keys, args.concurrency)
+            report(name, state, elapsed, latencies)
+
+    await DatabaseUtils.flush_command_counts()
+    await db.engine.engine.dispose()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--guilds", type=int, default=10_000)
+    parser.add_argument("--members", type=int, default=10, help="profiles per guild")
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--blacklist-share", type=float, default=0.2)
+    parser.add_argument("--blacklist", type=int, default=50, help="tags per list")
+    parser.add_argument("--bookmark-share", type=float, default=0.1)
+    parser.add_argument("--bookmarks", type=int, default=30, help="posts per list")
+    parser.add_argument("--vocabulary", type=int, default=20_000)
+    parser.add_argument("--samples", type=int, default=2000, help="ops per pass")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--only", nargs="+", help="operations to run")
+    parser.add_argument("--db-profile", default="performance")
+    parser.add_argument("--db", type=Path, help="keep the database at this path")
+    parser.add_argument("--reuse", action="store_true", help="skip seeding --db")
+    parser.add_argument("--seed", type=int, default=34)
+    args = parser.parse_args()
+
+    if args.db is not None:
+        await run(args, args.db.resolve())
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        await run(args, Path(tmp) / "bench.db")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+"""
+Compares startup time and resident memory of the bot's gateway profiles by
+logging in with BOT_TOKEN once per profile, each in a fresh interpreter
+
+    uv run benchmarks/gateway_profile.py --profiles full lean --runs 3
+
+Every run connects to Discord for real, so the numbers depend on how many
+guilds the bot is in. Reports seconds until on_ready (which waits for member
+chunking when the profile chunks at startup), RSS at on_ready and the members
+the client ended up caching.
+"""
+
+import argparse
+import asyncio
+import json
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+
+def rss_mib() -> float:
+    """
+    Current RSS from /proc where available, peak RSS otherwise
+    """
+
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    # ru_maxrss is KiB on linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+async def measure(profile: str) -> Dict[str, Any]:
+    import discord
+    from discord.ext import commands
+
+    from env import EnvConfig
+    from utils.gateway import GATEWAY_PROFILES
+
+    environment = EnvConfig.from_env()
+    start = time.perf_counter()
+
+    client = commands.Bot(
+        command_prefix=">>",
+        help_command=None,
+        **GATEWAY_PROFILES[profile].client_options(),
+    )
+    result: Dict[str, Any] = {}
+
+    @client.event
+    async def on_ready() -> None:
+        result["startup"] = time.perf_counter() - start
+        result["rss"] = rss_mib()
+        result["guilds"] = len(client.guilds)
+        result["members"] = sum(len(guild.members) for guild in client.guilds)
+        await client.close()
+
+    try:
+        await client.start(environment.BOT_TOKEN)
+    except discord.PrivilegedIntentsRequired:
+        raise SystemExit(f"{profile}: enable the privileged intents it requests")
+
+    return result
+
+
+def run_child(profile: str) -> Dict[str, Any]:
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", profile],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--profiles", nargs="+", default=["full", "lean"])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(measure(args.child))))
+        return
+
+    print(f"{'profile':<8} {'startup s':>10} {'rss MiB':>9} {'guilds':>7} {'members':>9}")
+    for profile in args.profiles:
+        runs: List[Dict[str, Any]] = [run_child(profile) for _ in range(args.runs)]
+        print(
+            f"{profile:<8} "
+            f"{statistics.median(r['startup'] for r in runs):>10.2f} "
+            f"{statistics.median(r['rss'] for r in runs):>9.1f} "
+            f"{runs[-1]['guilds']:>7} "
+            f"{runs[-1]['members']:>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
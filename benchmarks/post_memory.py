@@ -0,0 +1,120 @@
+"""
+Measures the memory held by cached Rule34 posts, comparing the previous
+dataclass-with-list-of-tags representation against the compact Rule34Post
+
+    uv run benchmarks/post_memory.py --pools 64 --posts 1000
+
+Results are extrapolated to a full cache of --cache-size pools. The shared tag
+vocabulary is warmed up front and reported separately.
+"""
+
+import argparse
+import random
+import sys
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from cogs.rule34.api import Rule34Post
+from cogs.rule34.vocabulary import TAG_VOCABULARY
+
+
+@dataclass
+class LegacyRule34Post:
+    id: str
+    tags: List[str]
+    file_url: str
+
+    @classmethod
+    def from_dict(cls, post: Dict[str, Any]) -> "LegacyRule34Post":
+        tags_raw = post.get("tags", "")
+        return cls(
+            id=str(post.get("id", "unknown")),
+            tags=tags_raw.split() if isinstance(tags_raw, str) else [],
+            file_url=str(post.get("file_url", "")),
+        )
+
+
+def make_page(
+    rng: random.Random, vocabulary: List[str], posts: int, tags_per_post: int
+) -> List[Dict[str, Any]]:
+    page = []
+    for _ in range(posts):
+        post_id = rng.randrange(10_000_000)
+        # popular tags dominate real posts, skew sampling towards the head
+        tags = {
+            vocabulary[int(len(vocabulary) * rng.random() ** 3)]
+            for _ in range(tags_per_post)
+        }
+        page.append(
+            {
+                "id": post_id,
+                "tags": " ".join(tags),
+                "file_url": f"https://api-cdn.rule34.xxx/images/{post_id}/{post_id:x}.jpeg",
+            }
+        )
+    return page
+
+
+def measure(
+    parse: Callable[[Dict[str, Any]], Any],
+    args: argparse.Namespace,
+    vocabulary: List[str],
+) -> int:
+    rng = random.Random(args.seed)
+
+    tracemalloc.start()
+    pools = [
+        [parse(post) for post in make_page(rng, vocabulary, args.posts, args.tags)]
+        for _ in range(args.pools)
+    ]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del pools
+    return current
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pools", type=int, default=64)
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--tags", type=int, default=30, help="tags per post")
+    parser.add_argument("--vocabulary", type=int, default=100_000)
+    parser.add_argument("--cache-size", type=int, default=1024)
+    parser.add_argument("--seed", type=int, default=34)
+    args = parser.parse_args()
+
+    vocabulary = [f"tag_{i}_{'x' * (i % 12)}" for i in range(args.vocabulary)]
+    total_posts = args.pools * args.posts
+
+    # the shared vocabulary is a one-off cost, measure it apart from the posts
+    tracemalloc.start()
+    TAG_VOCABULARY.encode(vocabulary)
+    vocabulary_held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    for name, parse in (
+        ("legacy", LegacyRule34Post.from_dict),
+        ("compact", Rule34Post.from_dict),
+    ):
+        held = measure(parse, args, vocabulary)
+        per_post = held / total_posts
+        projected = per_post * args.cache_size * args.posts
+        print(
+            f"{name:<8} {held / 2**20:>9.1f} MiB for {total_posts} posts  "
+            f"{per_post:>7.0f} B/post  "
+            f"~{projected / 2**20:>8.1f} MiB for {args.cache_size} full pools"
+        )
+
+    print(
+        f"shared tag vocabulary of {len(TAG_VOCABULARY)} tags: "
+        f"{vocabulary_held / 2**20:.1f} MiB"
+    )
+
+
+if __name__ == "__main__":
+    main()
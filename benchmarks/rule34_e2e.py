@@ -0,0 +1,301 @@
+"""
+End-to-end load benchmark of the Rule34 cog against a local stand-in of the
+rule34 dapi endpoint
+
+    uv run benchmarks/rule34_e2e.py --commands 2000 --concurrency 32 --latency 80
+
+Commands run through the cog's invoke hooks and callbacks with fake contexts
+against a temporary database, so everything but Discord itself is exercised.
+Reports commands/s, latency percentiles per command and the span breakdown
+recorded by utils.tracing.
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, Tuple
+from xml.sax.saxutils import quoteattr
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from aiohttp import web
+
+from cogs.rule34.cog import Rule34Cog
+from cogs.rule34.utils import Rule34DatabaseUtils
+from db.engine import init_db
+from db.utils import DatabaseUtils
+from utils.tracing import Tracing
+
+
+class StandInServer:
+    """
+    Serves `index.php?page=dapi&s=post&q=index`, as json pages when `json=1`
+    is given and as xml pages carrying the total count otherwise
+    """
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.latency = args.latency / 1000
+        self.jitter = args.jitter / 1000
+        self.results = args.results
+        self.error_rate = args.error_rate
+        self.tags_per_post = args.tags_per_post
+        self.vocabulary = [f"tag_{i}" for i in range(args.vocabulary)]
+        self.requests = 0
+        self.errors = 0
+
+        self._runner: web.AppRunner
+
+    def _post(self, query: str, index: int) -> Dict[str, Any]:
+        rng = random.Random(f"{query}:{index}")
+        post_id = rng.randrange(10_000_000)
+
+        # every post carries the queried tags plus popularity skewed extras
+        tags = {tag for tag in query.split() if not tag.startswith("-")}
+        while len(tags) < self.tags_per_post:
+            tags.add(self.vocabulary[int(len(self.vocabulary) * rng.random() ** 3)])
+
+        return {
+            "id": post_id,
+            "tags": " ".join(tags),
+            "file_url": f"http://127.0.0.1/images/{post_id}.jpeg",
+        }
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+        if random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=500)
+
+        query = request.query.get("tags", "")
+        limit = int(request.query.get("limit", 100))
+
+        start = int(request.query.get("pid", 0)) * limit
+        posts = [
+            self._post(query, i) for i in range(start, min(start + limit, self.results))
+        ]
+
+        if "json" not in request.query:
+            attributes = [
+                " ".join(f"{k}={quoteattr(str(v))}" for k, v in post.items())
+                for post in posts
+            ]
+            elements = "".join(f"<post {attrs}/>" for attrs in attributes)
+            return web.Response(
+                text=f'<posts count="{self.results}" offset="{start}">'
+                f"{elements}</posts>",
+                content_type="text/xml",
+            )
+
+        if not posts:
+            # the real api answers pages past the end with an empty body
+            return web.Response(text="")
+
+        return web.json_response(posts)
+
+    async def start(self, port: int) -> str:
+        app = web.Application()
+        app.router.add_get("/index.php", self.handle)
+
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", port).start()
+
+        return f"http://127.0.0.1:{port}/index.php?page=dapi&s=post&q=index"
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+
+
+def make_context(guild_id: int, user_id: int, reply_latency: float) -> Any:
+    async def reply(*args: Any, **kwargs: Any) -> None:
+        with Tracing.span("reply"):
+            await asyncio.sleep(reply_latency)
+
+    return SimpleNamespace(
+        guild=SimpleNamespace(id=guild_id),
+        author=SimpleNamespace(
+            id=user_id, display_name=f"user {user_id}", display_avatar=None
+        ),
+        message=SimpleNamespace(created_at=datetime.now(timezone.utc), attachments=[]),
+        reply=reply,
+        send=reply,
+    )
+
+
+async def invoke(cog: Rule34Cog, name: str, ctx: Any, **kwargs: Any) -> None:
+    """
+    Mirrors what commands.Command.invoke does around the callback
+    """
+
+    command = getattr(cog, name)
+    with Tracing.command(command.qualified_name):
+        await cog.cog_before_invoke(ctx)
+        try:
+            await command.callback(cog, ctx, **kwargs)
+        finally:
+            await cog.cog_after_invoke(ctx)
+
+
+def parse_mix(mix: str) -> List[Tuple[str, float]]:
+    weights = []
+    for part in mix.split(","):
+        name, weight = part.split("=")
+        weights.append((name.strip(), float(weight)))
+    return weights
+
+
+async def setup_users(args: argparse.Namespace, rng: random.Random) -> None:
+    for guild_id in range(args.guilds):
+        await DatabaseUtils.fetch_or_create_guild(str(guild_id))
+        await DatabaseUtils.update_guild(str(guild_id), r34_enabled=True)
+
+    for user_id in range(args.users):
+        guild_id = user_id % args.guilds
+        tags = [f"tag_{rng.randrange(args.vocabulary)}" for _ in range(args.blacklist)]
+        await Rule34DatabaseUtils.add_blacklist_tags(str(guild_id), str(user_id), tags)
+
+
+async def worker(
+    cog: Rule34Cog,
+    args: argparse.Namespace,
+    rng: random.Random,
+    queue: "asyncio.Queue[str]",
+    latencies: Dict[str, List[float]],
+    failures: Dict[str, int],
+) -> None:
+    while True:
+        try:
+            name = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+
+        user_id = rng.randrange(args.users)
+        ctx = make_context(user_id % args.guilds, user_id, args.reply_latency / 1000)
+
+        kwargs = {}
+        if name == "search":
+            # a few popular queries dominate, like real usage
+            query = int(args.queries * rng.random() ** 2)
+            kwargs["tags"] = f"tag_{query} tag_{query + 1}"
+
+        start = time.perf_counter()
+        try:
+            await invoke(cog, name, ctx, **kwargs)
+        except Exception:
+            failures[name] = failures.get(name, 0) + 1
+            continue
+
+        latencies.setdefault(name, []).append(time.perf_counter() - start)
+
+
+def percentile(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--commands", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mix", default="search=3,random=1")
+    parser.add_argument("--guilds", type=int, default=8)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--blacklist", type=int, default=5, help="tags per user")
+    parser.add_argument("--latency", type=float, default=80, help="upstream ms")
+    parser.add_argument("--jitter", type=float, default=20, help="upstream ms")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--results", type=int, default=3000, help="per query")
+    parser.add_argument("--tags-per-post", type=int, default=25)
+    parser.add_argument("--vocabulary", type=int, default=5000)
+    parser.add_argument("--reply-latency", type=float, default=0, help="ms")
+    parser.add_argument("--db-profile", default="performance")
+    parser.add_argument("--port", type=int, default=8734)
+    parser.add_argument("--seed", type=int, default=34)
+    parser.add_argument(
+        "--no-rate-limit", action="store_true", help="disable the upstream limiter"
+    )
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    server = StandInServer(args)
+    base_url = await server.start(args.port)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        await init_db(args.db_profile, Path(tmp) / "bench.db")
+        await setup_users(args, rng)
+
+        cog = Rule34Cog(client=None)  # type: ignore[arg-type]
+        cog.r34_api.base_url = base_url
+        if args.no_rate_limit:
+            cog.r34_api.limiter = None
+
+        names, weights = zip(*parse_mix(args.mix))
+        queue: "asyncio.Queue[str]" = asyncio.Queue()
+        for name in rng.choices(names, weights, k=args.commands):
+            queue.put_nowait(name)
+
+        Tracing.HISTOGRAMS.clear()
+        latencies: Dict[str, List[float]] = {}
+        failures: Dict[str, int] = {}
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(
+                worker(cog, args, rng, queue, latencies, failures)
+                for _ in range(args.concurrency)
+            )
+        )
+        elapsed = time.perf_counter() - start
+
+        await cog.r34_api.close()
+        await DatabaseUtils.flush_command_counts()
+
+    await server.stop()
+
+    completed = sum(len(values) for values in latencies.values())
+    print(
+        f"{completed} commands in {elapsed:.2f}s  {completed / elapsed:.1f} commands/s  "
+        f"failed {sum(failures.values())}  "
+        f"upstream requests {server.requests} (errors {server.errors})"
+    )
+    if (limiter := cog.r34_api.limiter) is not None:
+        print(
+            f"rate limiter admitted {limiter.stats.admitted} "
+            f"rejected {limiter.stats.rejected}  "
+            f"wait p95 {limiter.stats.wait.percentile(95) * 1000:.1f}ms"
+        )
+
+    print(
+        f"\n{'command':<10} {'count':>6} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9}"
+    )
+    for name, values in sorted(latencies.items()):
+        values.sort()
+        print(
+            f"{name:<10} {len(values):>6} "
+            f"{statistics.mean(values) * 1000:>7.1f}ms "
+            + " ".join(f"{percentile(values, q) * 1000:>7.1f}ms" for q in (50, 95, 99))
+        )
+
+    print(
+        f"\n{'command':<14} {'span':<13} {'count':>6} {'p50':>9} {'p95':>9} {'p99':>9}"
+    )
+    for command, span, histogram in Tracing.snapshot():
+        print(
+            f"{command:<14} {span:<13} {histogram.count:>6} "
+            + " ".join(
+                f"{histogram.percentile(q) * 1000:>7.1f}ms" for q in (50, 95, 99)
+            )
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""
+Compares SQLite commit throughput of every storage profile in db.profiles
+
+    uv run benchmarks/sqlite_profile.py --workers 16 --commits 250
+
+Each worker repeatedly opens a session, reads a guild row, inserts a new guild
+and commits, which mirrors the read-then-write pattern of the bot's commands.
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from sqlalchemy.exc import OperationalError
+from sqlmodel import select
+
+from db.engine import get_session, init_db
+from db.models import Guild
+from db.profiles import STORAGE_PROFILES
+
+
+async def worker(
+    worker_id: int, commits: int, latencies: List[float], errors: List[str]
+) -> None:
+    for i in range(commits):
+        start = time.perf_counter()
+        try:
+            async with get_session() as session:
+                await session.execute(select(Guild).where(Guild.id == "seed"))
+                session.add(Guild(id=f"{worker_id}-{i}"))
+                await session.commit()
+        except OperationalError as e:
+            errors.append(str(e.orig))
+            continue
+
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_profile(profile: str, workers: int, commits: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        await init_db(profile, Path(tmp) / "bench.db")
+
+        async with get_session() as session:
+            session.add(Guild(id="seed"))
+            await session.commit()
+
+        latencies: List[float] = []
+        errors: List[str] = []
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(worker(i, commits, latencies, errors) for i in range(workers))
+        )
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0.0
+        print(
+            f"{profile:<12} "
+            f"{len(latencies) / elapsed:>10.1f} commits/s  "
+            f"p50 {statistics.median(latencies) * 1000 if latencies else 0:>7.2f}ms  "
+            f"p99 {p99 * 1000:>7.2f}ms  "
+            f"errors {len(errors)}"
+        )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--commits", type=int, default=250)
+    parser.add_argument("--profiles", nargs="+", default=list(STORAGE_PROFILES.keys()))
+    args = parser.parse_args()
+
+    for profile in args.profiles:
+        await run_profile(profile, args.workers, args.commits)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,157 @@
+import aiohttp
+import asyncio
+import multiprocessing
+import signal
+import time
+from multiprocessing.process import BaseProcess
+from typing import Dict, Final, List
+
+from db.engine import init_db
+from env import EnvConfig
+
+
+def run_cluster(cluster_id: int, shard_ids: List[int], shard_count: int) -> None:
+    """
+    Entry point of a cluster process, runs the bot for its shards on its own
+    event loop
+    """
+
+    # imported here so the configuration is loaded inside the child process
+    from main import main
+
+    async def run() -> None:
+        task = asyncio.current_task()
+        assert task is not None
+
+        # stop through main's cleanup, which flushes buffered writes
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+        await main(shard_ids, shard_count, cluster_id)
+
+    try:
+        asyncio.run(run())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+class ClusterLauncher:
+    """
+    Spreads the bot's shards over CLUSTER_PROCESSES worker processes and
+    restarts workers that crash, waiting longer after every crash in a row
+    """
+
+    GATEWAY_URL: Final[str] = "https://discord.com/api/v10/gateway/bot"
+    RESTART_DELAY: Final[float] = 5.0
+    MAX_RESTART_DELAY: Final[float] = 300.0
+    # a worker up for this long no longer counts as crash looping
+    STABLE_UPTIME: Final[float] = 60.0
+    POLL_INTERVAL: Final[float] = 1.0
+
+    def __init__(self, environment: EnvConfig) -> None:
+        self.environment = environment
+        self.processes: Dict[int, BaseProcess] = {}
+        self.stopping = False
+
+        self._started_at: Dict[int, float] = {}
+        # crashes in a row and pending restarts, per cluster
+        self._crashes: Dict[int, int] = {}
+        self._restart_at: Dict[int, float] = {}
+
+        # spawn gives every worker a clean interpreter and event loop
+        self._context = multiprocessing.get_context("spawn")
+
+    async def fetch_shard_count(self) -> int:
+        """
+        Asks Discord for its recommended shard count for this bot
+        """
+
+        headers = {"Authorization": f"Bot {self.environment.BOT_TOKEN}"}
+        async with aiohttp.ClientSession() as session:
+            async with session.get(self.GATEWAY_URL, headers=headers) as response:
+                response.raise_for_status()
+                data = await response.json()
+                return int(data["shards"])
+
+    @staticmethod
+    def shard_ranges(shard_count: int, processes: int) -> List[List[int]]:
+        """
+        Splits the shards into contiguous, evenly sized ranges
+        """
+
+        size, extra = divmod(shard_count, processes)
+        ranges, start = [], 0
+        for i in range(processes):
+            end = start + size + (1 if i < extra else 0)
+            ranges.append(list(range(start, end)))
+            start = end
+        return ranges
+
+    def _start(self, cluster_id: int, shard_ids: List[int], shard_count: int) -> None:
+        process = self._context.Process(
+            target=run_cluster,
+            args=(cluster_id, shard_ids, shard_count),
+            name=f"cluster-{cluster_id}",
+        )
+        process.start()
+        self.processes[cluster_id] = process
+        self._started_at[cluster_id] = time.monotonic()
+        print(f"Started cluster {cluster_id} with shards {shard_ids}")
+
+    def _schedule_restart(self, cluster_id: int, exitcode: object) -> None:
+        now = time.monotonic()
+        if now - self._started_at[cluster_id] >= self.STABLE_UPTIME:
+            self._crashes[cluster_id] = 0
+
+        crashes = self._crashes.get(cluster_id, 0)
+        delay = min(self.RESTART_DELAY * 2**crashes, self.MAX_RESTART_DELAY)
+        self._crashes[cluster_id] = crashes + 1
+        self._restart_at[cluster_id] = now + delay
+
+        print(f"Cluster {cluster_id} exited with {exitcode}, restarting in {delay}s")
+
+    def _stop(self, *_args: object) -> None:
+        self.stopping = True
+
+    def run(self) -> None:
+        shard_count = self.environment.SHARD_COUNT or asyncio.run(
+            self.fetch_shard_count()
+        )
+        processes = min(self.environment.CLUSTER_PROCESSES, shard_count)
+        ranges = self.shard_ranges(shard_count, processes)
+
+        # create the schema once, before workers race each other for it
+        asyncio.run(init_db(self.environment.DB_PROFILE))
+
+        signal.signal(signal.SIGTERM, self._stop)
+        for cluster_id, shard_ids in enumerate(ranges):
+            self._start(cluster_id, shard_ids, shard_count)
+
+        try:
+            while not self.stopping:
+                time.sleep(self.POLL_INTERVAL)
+                # every cluster shut down cleanly
+                if all(p.exitcode == 0 for p in self.processes.values()):
+                    break
+
+                for cluster_id, process in list(self.processes.items()):
+                    if process.is_alive() or process.exitcode == 0:
+                        continue
+
+                    restart_at = self._restart_at.get(cluster_id)
+                    if restart_at is None:
+                        # restarted on a later poll, the others stay monitored
+                        self._schedule_restart(cluster_id, process.exitcode)
+                    elif time.monotonic() >= restart_at:
+                        del self._restart_at[cluster_id]
+                        self._start(cluster_id, ranges[cluster_id], shard_count)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for process in self.processes.values():
+                if process.is_alive():
+                    process.terminate()
+            for process in self.processes.values():
+                process.join()
+
+
+if __name__ == "__main__":
+    ClusterLauncher(EnvConfig.from_env()).run()
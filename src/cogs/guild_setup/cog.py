@@ -1,4 +1,3 @@
-import discord
 from discord.ext import commands
 
 from db.utils import DatabaseUtils as DBUtils
@@ -10,10 +9,6 @@ class GuildSetupCog(commands.Cog):
     def __init__(self, client: commands.Bot) -> None:
         self.client = client
 
-    @commands.Cog.listener()
-    async def on_guild_join(self, guild: discord.Guild) -> None:
-        await DBUtils.create_guild(guild_id=str(guild.id))
-
     @commands.group(name="guild", invoke_without_command=True)
     @commands.guild_only()
     async def guild_group(self, ctx: commands.Context) -> None:
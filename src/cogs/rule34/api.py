@@ -1,18 +1,59 @@
-import random
-import requests
-from cachetools import TTLCache
-from dataclasses import dataclass
-from typing import Any, Dict, Final, List, Optional
+import aiohttp
+import asyncio
+import json
+import time
+from array import array
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Collection,
+    Dict,
+    Final,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
 from urllib.parse import quote_plus
+from xml.etree import ElementTree
 
+from cogs.rule34.pool import PostPool
+from cogs.rule34.seen import RecentlySeen
+from cogs.rule34.stream import PagedResultStream
 from cogs.rule34.tag_group import TagGroup
+from cogs.rule34.vocabulary import TAG_VOCABULARY
+from utils.cache import InstrumentedLRUCache, InstrumentedTLRUCache, register_cache
+from utils.circuit import CircuitBreaker, CircuitOpen
+from utils.ratelimit import FairRateLimiter, RateLimitExceeded
+from utils.tracing import Tracing
 
+if TYPE_CHECKING:
+    from cogs.rule34.persistence import PersistentPoolStore
 
-@dataclass
+
+@dataclass(slots=True)
 class Rule34Post:
     id: str
-    tags: List[str]
+    tag_ids: array
     file_url: str
+    # vocabulary table the tag ids index into
+    tag_table: List[str] = field(repr=False, compare=False)
+
+    @property
+    def tags(self) -> List[str]:
+        return [self.tag_table[tag_id] for tag_id in self.tag_ids]
+
+    def adopt_vocabulary(self) -> None:
+        """
+        Re-encodes the tags into the current vocabulary table after a compaction
+        """
+
+        if self.tag_table is not TAG_VOCABULARY.table:
+            self.tag_ids = TAG_VOCABULARY.encode(self.tags)
+            self.tag_table = TAG_VOCABULARY.table
 
     @classmethod
     def from_dict(cls, post: Dict[str, Any]) -> "Rule34Post":
@@ -22,7 +63,15 @@ class Rule34Post:
 
         tags_list: List[str] = tags_raw.split() if isinstance(tags_raw, str) else []
 
-        return cls(id=id_val, tags=tags_list, file_url=file_url_val)
+        return cls(
+            id=id_val,
+            tag_ids=TAG_VOCABULARY.encode(tags_list),
+            file_url=file_url_val,
+            tag_table=TAG_VOCABULARY.table,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "tags": " ".join(self.tags), "file_url": self.file_url}
 
     def get_output_string(self, max_tag_length: int = 1500) -> str:
         tag_str = " ".join(self.tags)
@@ -48,111 +97,559 @@ class Rule34APIError(Exception):
     pass
 
 
+class Rule34Unavailable(Rule34APIError):
+    """
+    The upstream is not asked at all, e.g. while the circuit breaker is open
+    """
+
+
+class Rule34RateLimited(Rule34Unavailable):
+    pass
+
+
+# the guild upstream requests are made for, inherited by the fetch tasks it starts
+_upstream_flow: ContextVar[str] = ContextVar("r34_upstream_flow", default="")
+
+
 class Rule34API:
-    API_URL: Final[str] = (
-        "https://api.rule34.xxx/index.php?page=dapi&s=post&q=index&json=1"
-    )
+    BASE_URL: Final[str] = "https://api.rule34.xxx/index.php?page=dapi&s=post&q=index"
     DEFAULT_LIMIT: Final[int] = 1000
     DEFAULT_TIMEOUT: Final[int] = 30
+    DEFAULT_MAX_CONNECTIONS: Final[int] = 16
+    DEFAULT_MAX_CONCURRENCY: Final[int] = 8
+    DEFAULT_KEEPALIVE_TIMEOUT: Final[int] = 60
+    DEFAULT_MAX_POOL_SIZE: Final[int] = 5000
+    DEFAULT_MAX_VIEWERS: Final[int] = 4096
+    DEFAULT_RATE_BURST: Final[int] = 8
+    DEFAULT_MAX_QUEUE_DEPTH: Final[int] = 64
+    DEFAULT_MAX_GUILD_QUEUE_DEPTH: Final[int] = 8
+    DEFAULT_LATEST_TTL: Final[int] = 30
+    DEFAULT_BREAKER_RESET_TIMEOUT: Final[float] = 30.0
 
     def __init__(
         self,
         cache_size: int = 1024,
         cache_ttl: int = 3600,
         timeout: int = DEFAULT_TIMEOUT,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        keepalive_timeout: int = DEFAULT_KEEPALIVE_TIMEOUT,
+        prefetch_watermark: Optional[int] = None,
+        max_pool_size: int = DEFAULT_MAX_POOL_SIZE,
+        local_blacklist: bool = False,
+        pool_store: Optional["PersistentPoolStore"] = None,
+        subsumption_min_matches: Optional[int] = None,
+        recently_seen_size: Optional[int] = None,
+        max_viewers: int = DEFAULT_MAX_VIEWERS,
+        rate_limit: Optional[float] = None,
+        rate_burst: int = DEFAULT_RATE_BURST,
+        max_queue_depth: int = DEFAULT_MAX_QUEUE_DEPTH,
+        max_guild_queue_depth: int = DEFAULT_MAX_GUILD_QUEUE_DEPTH,
+        stale_ttl: int = 0,
+        latest_ttl: int = DEFAULT_LATEST_TTL,
+        breaker_threshold: Optional[int] = None,
+        breaker_reset_timeout: float = DEFAULT_BREAKER_RESET_TIMEOUT,
+        base_url: str = BASE_URL,
     ) -> None:
-        self.cache: TTLCache[str, List[Rule34Post]] = TTLCache(
-            maxsize=cache_size, ttl=cache_ttl
+        # per-item expiry so pools restored from the pool store keep their ttl,
+        # expired pools are kept for stale_ttl more as a fallback
+        self.stale_ttl = stale_ttl
+        self.cache: InstrumentedTLRUCache[str, PostPool] = InstrumentedTLRUCache(
+            maxsize=cache_size,
+            ttu=lambda _key, pool, _now: pool.expires_at + self.stale_ttl,
+            timer=time.time,
         )
+        self.base_url = base_url
+        self.cache_ttl = cache_ttl
+        self.pool_store = pool_store
         self.timeout = timeout
-        self.session = requests.Session()
+        self.prefetch_watermark = prefetch_watermark
+        self.max_pool_size = max_pool_size
+        self.local_blacklist = local_blacklist
+        self.subsumption_min_matches = subsumption_min_matches
+        self.recently_seen_size = recently_seen_size
+        self.recently_seen: InstrumentedLRUCache[str, RecentlySeen] = (
+            InstrumentedLRUCache(maxsize=max_viewers)
+        )
+        register_cache("r34_pools", self.cache)
+        register_cache("r34_recently_seen", self.recently_seen)
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._request_semaphore = asyncio.Semaphore(max_concurrency)
+        self._inflight: Dict[str, asyncio.Task[None]] = {}
+
+        self.latest_ttl = latest_ttl
+        self._latest: Optional[Tuple[Rule34Post, float]] = None
+        self._latest_task: Optional[asyncio.Task[Optional[Rule34Post]]] = None
+
+        # requests per second across all guilds, queued fairly per guild
+        self.limiter: Optional[FairRateLimiter] = None
+        if rate_limit is not None:
+            self.limiter = FairRateLimiter(
+                "r34_upstream",
+                rate_limit,
+                rate_burst,
+                max_queue_depth,
+                max_guild_queue_depth,
+            )
+
+        # consecutive upstream failures after which requests stop being sent
+        self.breaker: Optional[CircuitBreaker] = None
+        if breaker_threshold is not None:
+            self.breaker = CircuitBreaker(
+                "r34_upstream", breaker_threshold, breaker_reset_timeout
+            )
+
+    @property
+    def api_url(self) -> str:
+        return f"{self.base_url}&json=1"
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Lazily creates the pooled HTTP session, it has to be created from within
+        the running event loop
+        """
+
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+
+        return self._session
+
+    async def close(self) -> None:
+        if self.pool_store is not None:
+            await self.pool_store.flush()
+
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _retrieve_from_cache(
+        self,
+        key: str,
+        consumer: str,
+        reset: bool = False,
+        excluded_tags: Collection[int] = (),
+        skip: Optional[Callable[[Rule34Post], bool]] = None,
+        counted: bool = True,
+    ) -> Optional[Rule34Post]:
+        # only the first lookup of a search counts towards the hit ratio
+        pool = self.cache.get(key) if counted else self.cache.peek(key)
+        if not pool:
+            return None
+
+        # stale pools are served while a fresh one is fetched behind them
+        if self._is_stale(pool):
+            self._start_fetch(key, pool.stream.limit, background=True)
+
+        post = pool.draw(consumer, reset, excluded_tags, skip=skip)
+        if post is not None:
+            self._maybe_prefetch(key, pool, consumer)
+
+        return post
+
+    @staticmethod
+    def _is_stale(pool: PostPool) -> bool:
+        return time.time() >= pool.expires_at
+
+    def _push_to_cache(self, key: str, pool: PostPool) -> None:
+        if pool.posts:
+            if not pool.expires_at:
+                pool.expires_at = time.time() + self.cache_ttl
+            self.cache[key] = pool
+
+            # evicted and expired pools leave their tags behind in the vocabulary
+            if TAG_VOCABULARY.needs_compaction():
+                TAG_VOCABULARY.compact(self._adopt_vocabulary)
+
+    def _adopt_vocabulary(self) -> None:
+        for pool in self.cache.values():
+            pool.adopt_vocabulary()
+        if self._latest is not None:
+            self._latest[0].adopt_vocabulary()
 
-    def _retrieve_from_cache(self, key: str, pop: bool = True) -> Optional[Rule34Post]:
-        posts = self.cache.get(key)
-        if not posts:
-            self.cache.pop(key, None)
+    def _persist(self, pool: PostPool) -> None:
+        if self.pool_store is not None and pool.posts:
+            self.pool_store.save(pool.query, pool.to_state(), pool.expires_at)
+
+    async def _load_persisted(self, query: str) -> Optional[PostPool]:
+        if self.pool_store is None:
             return None
 
-        index = random.randint(0, len(posts) - 1)
-        post = posts[index]
+        if (persisted := await self.pool_store.load(query)) is None:
+            return None
 
-        if pop:
-            posts.pop(index)
+        state, expires_at = persisted
+        try:
+            stream = PagedResultStream.from_state(
+                query, state["stream"], self._fetch_posts
+            )
+            posts = [Rule34Post.from_dict(post) for post in state["posts"]]
+            return PostPool(
+                query=query,
+                stream=stream,
+                posts=posts,
+                windowed=state["windowed"],
+                expires_at=expires_at,
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            return None
 
-            if not posts:
-                self.cache.pop(key, None)
+    def _maybe_prefetch(self, key: str, pool: PostPool, consumer: str) -> None:
+        """
+        Refills the pool in the background once the consumer's unseen posts drop
+        below the watermark
+        """
 
-        return post
+        if self.prefetch_watermark is None or not pool.can_extend(self.max_pool_size):
+            return
 
-    def _push_to_cache(self, key: str, posts: List[Rule34Post]) -> None:
-        if posts:
-            self.cache[key] = posts
+        remaining = pool.cursor(consumer).remaining(len(pool))
+        if remaining < self.prefetch_watermark and key not in self._inflight:
+            self._start_fetch(key, pool.stream.limit, background=True)
+
+    async def _request_text(self, url: str, timeout: Optional[float] = None) -> str:
+        request_timeout = aiohttp.ClientTimeout(
+            total=timeout if timeout is not None else self.timeout
+        )
+
+        if self.breaker is not None:
+            try:
+                self.breaker.before_call()
+            except CircuitOpen:
+                raise Rule34Unavailable("Upstream is failing, requests are paused")
+
+        if self.limiter is not None:
+            try:
+                await self.limiter.acquire(_upstream_flow.get())
+            except RateLimitExceeded:
+                raise Rule34RateLimited("Too many requests are queued upstream")
+
+        async with self._request_semaphore:
+            try:
+                session = self._get_session()
+                with Tracing.span("http"):
+                    async with session.get(url, timeout=request_timeout) as response:
+                        response.raise_for_status()
+                        text = await response.text()
+            except asyncio.TimeoutError:
+                self._record_failure()
+                raise Rule34APIError("Request timed out")
+            except aiohttp.ClientResponseError as e:
+                # other 4xx answers come from our request, not an unwell upstream
+                if e.status >= 500 or e.status == 429:
+                    self._record_failure()
+                raise Rule34APIError(f"HTTP error: {e.status}")
+            except aiohttp.ClientConnectionError:
+                self._record_failure()
+                raise Rule34APIError("Connection error occurred")
+            except aiohttp.ClientError as e:
+                self._record_failure()
+                raise Rule34APIError(f"Request failed: {str(e)}")
+
+        if self.breaker is not None:
+            self.breaker.record_success()
+        return text
+
+    def _record_failure(self) -> None:
+        if self.breaker is not None:
+            self.breaker.record_failure()
+
+    async def _make_request(self, url: str, timeout: Optional[float] = None) -> Any:
+        text = await self._request_text(url, timeout)
+
+        # the api answers queries without results with an empty body
+        if not text.strip():
+            return []
 
-    def _make_request(self, url: str) -> List[Any]:
         try:
-            response = self.session.get(url, timeout=self.timeout)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.Timeout:
-            raise Rule34APIError("Request timed out")
-        except requests.exceptions.ConnectionError:
-            raise Rule34APIError("Connection error occurred")
-        except requests.exceptions.HTTPError as e:
-            raise Rule34APIError(f"HTTP error: {e.response.status_code}")
-        except requests.exceptions.RequestException as e:
-            raise Rule34APIError(f"Request failed: {str(e)}")
+            return json.loads(text)
         except ValueError as e:
             raise Rule34APIError(f"Invalid JSON response: {str(e)}")
 
-    def search(
-        self, tags: TagGroup, limit: int = DEFAULT_LIMIT, prefer_whitelist: bool = True
-    ) -> Optional[Rule34Post]:
-        if not tags.is_valid():
-            tags.resolve_conflicts(prefer_whitelist)
+    async def _fetch_posts(
+        self, query: str, limit: int, page: int = 0
+    ) -> Tuple[List[Rule34Post], Optional[int]]:
+        """
+        A page of posts and the query's total number of results. Pages come
+        from the XML api, the only one reporting the total alongside the posts
+        """
 
-        query = tags.to_string()
-        key = tags.to_key()
+        tag_query_string = quote_plus(query)
+        url = f"{self.base_url}&tags={tag_query_string}&limit={limit}&pid={page}"
+
+        text = await self._request_text(url)
+        if not text.strip():
+            return [], None
+
+        try:
+            root = ElementTree.fromstring(text)
+        except ElementTree.ParseError as e:
+            raise Rule34APIError(f"Invalid XML response: {str(e)}")
 
-        cached_post = self._retrieve_from_cache(key, False)
-        if cached_post is None:
+        try:
+            total: Optional[int] = int(root.attrib["count"])
+        except (KeyError, ValueError) as e:
+            total = None
+
+        posts: List[Rule34Post] = []
+        for element in root.iter("post"):
             try:
-                tag_query_string = quote_plus(query)
-                url = f"{self.API_URL}&tags={tag_query_string}&limit={limit}"
+                posts.append(Rule34Post.from_dict(dict(element.attrib)))
+            except (ValueError, TypeError) as e:
+                continue
+
+        return posts, total
+
+    async def _fetch_into_cache(self, query: str, limit: int) -> None:
+        pool = self.cache.peek(query)
+        if pool is not None and self._is_stale(pool):
+            # refresh, the stale pool keeps being served until this succeeds
+            pool = None
+
+        try:
+            if pool is None:
+                # a warm restart finds the pool in the store instead of upstream
+                if (pool := await self._load_persisted(query)) is not None:
+                    self._push_to_cache(query, pool)
+                    return
+
+                stream = PagedResultStream(query, limit, self._fetch_posts)
+                pool = PostPool(query=query, stream=stream)
+                pool.extend(await anext(stream, []))
+                self._push_to_cache(query, pool)
+            elif pool.can_extend(self.max_pool_size):
+                pool.extend(await anext(pool.stream, []))
+            elif not pool.complete:
+                # the window is full or the pass is over, continue the stream in
+                # a fresh window instead of growing past the size cap
+                if pool.stream.finished:
+                    pool.stream.restart()
+
+                pool = PostPool(query=query, stream=pool.stream, windowed=True)
+                pool.extend(await anext(pool.stream, []))
+                self._push_to_cache(query, pool)
+            else:
+                return
+        except Rule34Unavailable:
+            raise
+        except Rule34APIError as e:
+            return
+
+        self._persist(pool)
+
+    def _start_fetch(
+        self, query: str, limit: int, background: bool = False
+    ) -> "asyncio.Task[None]":
+        """
+        Single-flight fetch, concurrent misses and refills on the same query
+        share one request. `background` fetches are not waited for by the
+        command starting them and are traced apart from it
+        """
+
+        task = self._inflight.get(query)
+        if task is None:
+            task = asyncio.create_task(
+                self._fetch_into_cache(query, limit),
+                context=Tracing.background() if background else None,
+            )
+            self._inflight[query] = task
+
+            def _clear_inflight(done: "asyncio.Task[None]") -> None:
+                if self._inflight.get(query) is done:
+                    del self._inflight[query]
+
+                # rejections reach whoever awaits the fetch, background
+                # refills have nobody and drop theirs
+                if not done.cancelled():
+                    done.exception()
+
+            task.add_done_callback(_clear_inflight)
+
+        return task
+
+    def _recently_seen(self, viewer: Optional[str]) -> Optional[RecentlySeen]:
+        if viewer is None or self.recently_seen_size is None:
+            return None
+
+        if (seen := self.recently_seen.get(viewer)) is None:
+            seen = self.recently_seen[viewer] = RecentlySeen(self.recently_seen_size)
+        return seen
+
+    def _split_blacklist(self, blacklist: Collection[str]) -> Tuple[Set[str], Set[str]]:
+        """
+        Splits a blacklist into tags sent upstream and tags filtered locally,
+        meta tags such as `score:<5` can only be evaluated upstream
+        """
+
+        normalized = TagGroup.normalize_tags(blacklist)
+        if not self.local_blacklist:
+            return normalized, set()
+
+        upstream = {tag for tag in normalized if ":" in tag}
+        return upstream, normalized - upstream
+
+    def _retrieve_subsumed(
+        self,
+        tags: TagGroup,
+        consumer: str,
+        excluded_tags: Set[int],
+        skip: Optional[Callable[[Rule34Post], bool]] = None,
+    ) -> Optional[Rule34Post]:
+        """
+        Answers a query from a cached broader pool, e.g. `a b` from the pool of
+        `a`, when enough of its posts match the narrower query
+        """
+
+        if self.subsumption_min_matches is None:
+            return None
+
+        best: Optional[Tuple[int, PostPool, Set[int], Set[int]]] = None
+        for pool in self.cache.values():
+            if not pool.subsumes(tags):
+                continue
+
+            extra_whitelist = set(tags.whitelisted) - pool.whitelist
+            required = TAG_VOCABULARY.known_ids(extra_whitelist)
+            if len(required) < len(extra_whitelist):
+                # a required tag was never seen, no cached post can match
+                continue
+
+            excluded = excluded_tags | TAG_VOCABULARY.known_ids(
+                set(tags.blacklisted) - pool.blacklist
+            )
+
+            matches = pool.count_eligible(excluded, required)
+            if best is None or matches > best[0]:
+                best = (matches, pool, excluded, required)
 
-                json_response = self._make_request(url)
+        if best is None or best[0] < self.subsumption_min_matches:
+            return None
+
+        _, pool, excluded, required = best
+        return pool.draw(consumer, False, excluded, required, skip)
+
+    async def search(
+        self,
+        tags: TagGroup,
+        limit: int = DEFAULT_LIMIT,
+        prefer_whitelist: bool = True,
+        blacklist: Collection[str] = (),
+        viewer: Optional[str] = None,
+    ) -> Optional[Rule34Post]:
+        """
+        Raises Rule34Unavailable when a needed upstream request is not sent
+        """
 
-                if not isinstance(json_response, list):
-                    return None
+        upstream_blacklist, local_blacklist = self._split_blacklist(blacklist)
+        tags.append_to_blacklist(upstream_blacklist)
 
-                posts: List[Rule34Post] = []
-                for post_data in json_response:
-                    try:
-                        if not isinstance(post_data, dict):
-                            raise TypeError
+        if not tags.is_valid():
+            tags.resolve_conflicts(prefer_whitelist)
 
-                        post = Rule34Post.from_dict(post_data)
-                        posts.append(post)
-                    except (ValueError, TypeError) as e:
-                        continue
+        if prefer_whitelist:
+            local_blacklist.difference_update(tags.whitelisted)
+        else:
+            tags.whitelisted = [t for t in tags.whitelisted if t not in local_blacklist]
 
-                if not posts:
-                    return None
+        # tags never seen in any post cannot match, so they need no filtering
+        excluded_tags = TAG_VOCABULARY.known_ids(local_blacklist)
 
-                self._push_to_cache(key, posts)
-            except Rule34APIError as e:
-                return None
+        # pools are shared by the canonical query, the additional key (guild)
+        # only selects which cursor the post is drawn from
+        query = tags.to_string()
+        consumer = tags.additional_key or ""
 
-        return self._retrieve_from_cache(key, True)
+        # posts the viewer was shown recently are passed over, even across
+        # cursor resets and refilled pools
+        seen = self._recently_seen(viewer)
+        skip = (lambda post: post.id in seen) if seen is not None else None
 
-    def latest(self) -> Optional[Rule34Post]:
+        flow_token = _upstream_flow.set(consumer)
         try:
-            url = f"{self.API_URL}&limit=1"
-            json_data = self._make_request(url)
+            post = self._retrieve_from_cache(
+                query, consumer, False, excluded_tags, skip
+            )
+            if post is None and query not in self.cache:
+                post = self._retrieve_subsumed(tags, consumer, excluded_tags, skip)
+            if post is None:
+                try:
+                    await asyncio.shield(self._start_fetch(query, limit))
+                except Rule34Unavailable:
+                    # a stale pool still in memory beats no answer at all
+                    post = self._retrieve_from_cache(
+                        query, consumer, True, excluded_tags, skip, counted=False
+                    )
+                    if post is None:
+                        raise
+                else:
+                    # the fetch may have seen blacklisted tags for the first time
+                    excluded_tags = TAG_VOCABULARY.known_ids(local_blacklist)
+                    post = self._retrieve_from_cache(
+                        query, consumer, True, excluded_tags, skip, counted=False
+                    )
+        finally:
+            _upstream_flow.reset(flow_token)
+
+        if post is not None and seen is not None:
+            seen.add(post.id)
+
+        return post
 
-            if not isinstance(json_data, list):
-                return None
+    async def _fetch_latest(self) -> Optional[Rule34Post]:
+        url = f"{self.api_url}&limit=1"
+        json_data = await self._make_request(url)
 
-            post_data: Dict[str, Any] = json_data[0]
-            return Rule34Post.from_dict(post_data)
+        if not isinstance(json_data, list):
+            return None
+
+        post_data: Dict[str, Any] = json_data[0]
+        post = Rule34Post.from_dict(post_data)
+        self._latest = (post, time.time())
+        return post
+
+    def _start_latest_fetch(
+        self, background: bool = False
+    ) -> "asyncio.Task[Optional[Rule34Post]]":
+        task = self._latest_task
+        if task is None or task.done():
+            task = self._latest_task = asyncio.create_task(
+                self._fetch_latest(),
+                context=Tracing.background() if background else None,
+            )
+            # failed background refreshes have nobody to report to
+            task.add_done_callback(
+                lambda done: done.cancelled() or done.exception()
+            )
+
+        return task
+
+    async def latest(self, consumer: str = "") -> Optional[Rule34Post]:
+        """
+        The newest post, answered from the last fetch for latest_ttl seconds.
+        Older answers are still returned while a refresh runs in the background
+        """
+
+        flow_token = _upstream_flow.set(consumer)
+        try:
+            if self._latest is not None:
+                post, fetched_at = self._latest
+                if time.time() - fetched_at >= self.latest_ttl:
+                    self._start_latest_fetch(background=True)
+                return post
+
+            return await asyncio.shield(self._start_latest_fetch())
+        except Rule34Unavailable:
+            raise
         except (Rule34APIError, ValueError, IndexError) as e:
             return None
+        finally:
+            _upstream_flow.reset(flow_token)
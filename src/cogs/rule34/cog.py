@@ -1,41 +1,81 @@
+import asyncio
 import discord
+import io
 from discord.ext import commands
 
-from typing import Final, Optional
+from typing import Final, List, Optional
 
-from cogs.rule34.api import Rule34API, TagGroup
+from cogs.rule34.api import (
+    Rule34API,
+    Rule34RateLimited,
+    Rule34Unavailable,
+    TagGroup,
+)
+from cogs.rule34.persistence import PersistentPoolStore
 from cogs.rule34.utils import Rule34DatabaseUtils
 from db.models import CommandCategory
 from db.utils import DatabaseUtils
 from hooks.register import register_hook_command
 from utils.formatter import Formatter as Fmt
 from utils.general import GenUtils
+from utils.tracing import Tracing
 
 
 class Rule34Cog(commands.Cog):
     RULE34_GREEN: Final[int] = 0xAAE5A4
+    PREFETCH_WATERMARK: Final[int] = 100
+    SUBSUMPTION_MIN_MATCHES: Final[int] = 50
+    RECENTLY_SEEN_SIZE: Final[int] = 256
+    MAX_IMPORT_BYTES: Final[int] = 64 * 1024
+    UPSTREAM_RATE_LIMIT: Final[float] = 4.0
+    STALE_TTL: Final[int] = 6 * 3600
+    BREAKER_THRESHOLD: Final[int] = 5
+    RATE_LIMITED_MESSAGE: Final[str] = (
+        "Rule34 is receiving too many requests right now, please try again shortly"
+    )
+    UNAVAILABLE_MESSAGE: Final[str] = (
+        "Rule34 is not responding right now, please try again shortly"
+    )
 
     def __init__(self, client: commands.Bot) -> None:
         self.client = client
-        self.r34_api = Rule34API()
+        # awaited by main before the storage is torn down
+        self.closing: Optional["asyncio.Task[None]"] = None
+        self.r34_api = Rule34API(
+            prefetch_watermark=self.PREFETCH_WATERMARK,
+            local_blacklist=True,
+            pool_store=PersistentPoolStore(),
+            subsumption_min_matches=self.SUBSUMPTION_MIN_MATCHES,
+            recently_seen_size=self.RECENTLY_SEEN_SIZE,
+            rate_limit=self.UPSTREAM_RATE_LIMIT,
+            stale_ttl=self.STALE_TTL,
+            breaker_threshold=self.BREAKER_THRESHOLD,
+        )
+
+    def cog_unload(self) -> None:
+        self.closing = asyncio.create_task(self.r34_api.close())
 
     async def cog_before_invoke(self, ctx: commands.Context) -> None:
         await register_hook_command(ctx)
 
-        guild: Optional[discord.Guild] = ctx.guild
-        if guild is not None:
-            db_guild = await DatabaseUtils.fetch_or_create_guild(str(guild.id))
-            if not db_guild.r34_enabled:
-                raise commands.CheckFailure("Feature_RULE34 is DISABLED for this guild")
+        with Tracing.span("before_invoke"):
+            guild: Optional[discord.Guild] = ctx.guild
+            if guild is not None:
+                db_guild = await DatabaseUtils.fetch_or_create_guild(str(guild.id))
+                if not db_guild.r34_enabled:
+                    raise commands.CheckFailure(
+                        "Feature_RULE34 is DISABLED for this guild"
+                    )
 
     async def cog_after_invoke(self, ctx: commands.Context) -> None:
-        user_id = str(ctx.author.id)
-        guild: Optional[discord.Guild] = ctx.guild
-        if guild is not None:
-            guild_id = str(guild.id)
-            await DatabaseUtils.increment_command_count(
-                guild_id, user_id, CommandCategory.RULE34
-            )
+        with Tracing.span("after_invoke"):
+            user_id = str(ctx.author.id)
+            guild: Optional[discord.Guild] = ctx.guild
+            if guild is not None:
+                guild_id = str(guild.id)
+                await DatabaseUtils.increment_command_count(
+                    guild_id, user_id, CommandCategory.RULE34
+                )
 
     @commands.group(name="rule34", aliases=["r34"], invoke_without_command=True)
     @commands.guild_only()
@@ -57,10 +97,28 @@ class Rule34Cog(commands.Cog):
     async def blacklist_group(self, ctx: commands.Context) -> None:
         await ctx.reply(
             Fmt.info(
-                "Available subcommands\n\t+ view\n\t+ add\n\t+ remove\n\t+ toggle\n"
+                "Available subcommands\n"
+                "\t+ view\n"
+                "\t+ add\n"
+                "\t+ remove\n"
+                "\t+ toggle\n"
+                "\t+ import\n"
+                "\t+ export\n"
             )
         )
 
+    async def _reply_unavailable(
+        self, ctx: commands.Context, error: Rule34Unavailable
+    ) -> None:
+        if isinstance(error, Rule34RateLimited):
+            await ctx.reply(Fmt.warning(self.RATE_LIMITED_MESSAGE))
+        else:
+            await ctx.reply(Fmt.warning(self.UNAVAILABLE_MESSAGE))
+
+    @staticmethod
+    def _parse_tags(tags: str) -> List[str]:
+        return tags.lower().replace(",", " ").split()
+
     @blacklist_group.command()
     async def view(self, ctx: commands.Context) -> None:
         guild_id, user_id = GenUtils.extract_guild_and_user_id(ctx)
@@ -91,8 +149,7 @@ class Rule34Cog(commands.Cog):
     async def add(self, ctx: commands.Context, *, tags: str) -> None:
         guild_id, user_id = GenUtils.extract_guild_and_user_id(ctx)
 
-        tag_list = tags.strip().lower().replace(",", " ").split(" ")
-        tag_list = [tag for tag in tag_list if tag.strip()]
+        tag_list = self._parse_tags(tags)
 
         rejected = await Rule34DatabaseUtils.add_blacklist_tags(
             guild_id, user_id, tag_list
@@ -108,8 +165,7 @@ class Rule34Cog(commands.Cog):
     async def remove(self, ctx: commands.Context, *, tags: str) -> None:
         guild_id, user_id = GenUtils.extract_guild_and_user_id(ctx)
 
-        tag_list = tags.strip().lower().replace(",", " ").split(" ")
-        tag_list = [tag for tag in tag_list if tag.strip()]
+        tag_list = self._parse_tags(tags)
 
         rejected = await Rule34DatabaseUtils.remove_blacklist_tags(
             guild_id, user_id, tag_list
@@ -137,9 +193,58 @@ class Rule34Cog(commands.Cog):
             f"> **Blacklist is now {'`ENABLED`' if new_state else '`DISABLED`'}**"
         )
 
+    @blacklist_group.command(name="import")
+    async def import_blacklist(self, ctx: commands.Context, *, tags: str = "") -> None:
+        guild_id, user_id = GenUtils.extract_guild_and_user_id(ctx)
+
+        # tags can be given inline and/or as an attached text file
+        text = tags
+        if ctx.message.attachments:
+            attachment = ctx.message.attachments[0]
+            if attachment.size > self.MAX_IMPORT_BYTES:
+                await ctx.reply(Fmt.error("Attached blacklist file is too large"))
+                return
+            text += " " + (await attachment.read()).decode("utf-8", errors="ignore")
+
+        tag_list = self._parse_tags(text)
+        if len(tag_list) == 0:
+            await ctx.reply(Fmt.error("Missing Required Arguments: tags"))
+            return
+
+        rejected = await Rule34DatabaseUtils.add_blacklist_tags(
+            guild_id, user_id, tag_list
+        )
+        imported = len(set(tag_list)) - len(rejected)
+
+        await ctx.reply(
+            f"> **Imported {imported} tag(s) into your blacklist, {len(rejected)} were already present.**"
+        )
+
+    @blacklist_group.command(name="export")
+    async def export_blacklist(self, ctx: commands.Context) -> None:
+        guild_id, user_id = GenUtils.extract_guild_and_user_id(ctx)
+
+        blacklist = await Rule34DatabaseUtils.get_blacklist(guild_id, user_id)
+        if len(blacklist) == 0:
+            await ctx.reply("> **Your blacklist is empty.**")
+            return
+
+        content = "\n".join(sorted(blacklist)).encode("utf-8")
+        await ctx.reply(
+            f"> **Exported {len(blacklist)} tag(s) from your blacklist.**",
+            file=discord.File(io.BytesIO(content), filename="blacklist.txt"),
+        )
+
     @rule34_group.command()
     async def latest(self, ctx: commands.Context) -> None:
-        post = self.r34_api.latest()
+        guild_id, _ = GenUtils.extract_guild_and_user_id(ctx)
+
+        try:
+            post = await self.r34_api.latest(consumer=guild_id)
+        except Rule34Unavailable as e:
+            await self._reply_unavailable(ctx, e)
+            return
+
         if post is None:
             await ctx.reply(
                 Fmt.error(
@@ -161,9 +266,14 @@ class Rule34Cog(commands.Cog):
             blacklist = await Rule34DatabaseUtils.get_blacklist(guild_id, user_id)
         else:
             blacklist = []
-        tags = TagGroup.from_list([], blacklist, additional_key=guild_id)
+        tags = TagGroup.from_list([], [], additional_key=guild_id)
+
+        try:
+            post = await self.r34_api.search(tags, blacklist=blacklist, viewer=user_id)
+        except Rule34Unavailable as e:
+            await self._reply_unavailable(ctx, e)
+            return
 
-        post = self.r34_api.search(tags)
         if post is None:
             await ctx.reply(
                 Fmt.error(
@@ -187,9 +297,15 @@ class Rule34Cog(commands.Cog):
             blacklist = []
 
         tag_group = TagGroup.from_string(tags, additional_key=guild_id)
-        tag_group.append_to_blacklist(blacklist)
 
-        post = self.r34_api.search(tag_group)
+        try:
+            post = await self.r34_api.search(
+                tag_group, blacklist=blacklist, viewer=user_id
+            )
+        except Rule34Unavailable as e:
+            await self._reply_unavailable(ctx, e)
+            return
+
         if post is None:
             await ctx.reply(f"> **Error: Zero posts found for search query.**")
             return
@@ -0,0 +1,64 @@
+import asyncio
+import json
+import time
+from sqlalchemy.exc import SQLAlchemyError
+from typing import Any, Dict, Optional, Set, Tuple
+
+from cogs.rule34.utils import Rule34DatabaseUtils
+from utils.tracing import Tracing
+
+
+class PersistentPoolStore:
+    """
+    Database backed tier below Rule34API.cache so restarts come up with warm
+    pools, writes happen in the background off the command path
+    """
+
+    def __init__(self) -> None:
+        self._purged = False
+        self._pending: Set[asyncio.Task[None]] = set()
+
+    async def load(self, query: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        try:
+            if not self._purged:
+                await Rule34DatabaseUtils.purge_expired_post_pools(time.time())
+                self._purged = True
+
+            record = await Rule34DatabaseUtils.fetch_post_pool(query)
+        except SQLAlchemyError as e:
+            print(f"Failed to load persisted pool: {e}")
+            return None
+
+        if record is None or record.expires_at <= time.time():
+            return None
+
+        try:
+            state = await asyncio.to_thread(json.loads, record.payload)
+        except ValueError as e:
+            # a corrupt row would fail every load of the query until it expires
+            print(f"Dropping corrupt persisted pool: {e}")
+            try:
+                await Rule34DatabaseUtils.delete_post_pool(query)
+            except SQLAlchemyError as e:
+                print(f"Failed to drop persisted pool: {e}")
+            return None
+
+        return state, record.expires_at
+
+    async def _save(self, query: str, state: Dict[str, Any], expires_at: float) -> None:
+        try:
+            payload = await asyncio.to_thread(json.dumps, state, separators=(",", ":"))
+            await Rule34DatabaseUtils.save_post_pool(query, payload, expires_at)
+        except SQLAlchemyError as e:
+            print(f"Failed to persist pool: {e}")
+
+    def save(self, query: str, state: Dict[str, Any], expires_at: float) -> None:
+        task = asyncio.create_task(
+            self._save(query, state, expires_at), context=Tracing.background()
+        )
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def flush(self) -> None:
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
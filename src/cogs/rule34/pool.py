@@ -0,0 +1,273 @@
+import random
+from array import array
+from dataclasses import dataclass, field
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    ClassVar,
+    Collection,
+    Dict,
+    FrozenSet,
+    List,
+    Optional,
+    Set,
+)
+
+from cogs.rule34.stream import PagedResultStream
+from cogs.rule34.tag_group import TagGroup
+from cogs.rule34.vocabulary import TAG_VOCABULARY
+
+if TYPE_CHECKING:
+    from cogs.rule34.api import Rule34Post
+
+
+@dataclass
+class SamplingCursor:
+    """
+    Per-consumer view over a shared pool. Holds a lazily shuffled permutation of
+    the pool's indices, everything before `taken` has been handed out
+    """
+
+    order: array = field(default_factory=lambda: array("I"))
+    taken: int = 0
+
+    MAX_REJECTIONS: ClassVar[int] = 32
+
+    def remaining(self, size: int) -> int:
+        return size - self.taken
+
+    def _grow(self, size: int) -> None:
+        # posts appended to the pool join the unconsumed tail
+        if len(self.order) < size:
+            self.order.extend(range(len(self.order), size))
+
+    def _take(self, slot: int) -> int:
+        order, taken = self.order, self.taken
+        order[slot], order[taken] = order[taken], order[slot]
+        self.taken += 1
+        return order[taken]
+
+    def draw(
+        self,
+        size: int,
+        excluded: int = 0,
+        skip: Optional[Callable[[int], bool]] = None,
+    ) -> Optional[int]:
+        """
+        Draws an unconsumed index in constant time, `excluded` is a bitset and
+        `skip` a predicate of indices that must be passed over without being
+        consumed
+        """
+
+        self._grow(size)
+        if self.taken >= size:
+            return None
+
+        def eligible(index: int) -> bool:
+            return not (excluded >> index) & 1 and (skip is None or not skip(index))
+
+        for _ in range(self.MAX_REJECTIONS):
+            slot = random.randrange(self.taken, size)
+            if eligible(self.order[slot]):
+                return self._take(slot)
+
+        # heavily filtered, scan the unconsumed slots instead
+        slots = [slot for slot in range(self.taken, size) if eligible(self.order[slot])]
+        if not slots:
+            return None
+
+        return self._take(random.choice(slots))
+
+    def reset(self) -> None:
+        # the permutation stays valid, only the consumed boundary moves
+        self.taken = 0
+
+
+@dataclass
+class PostPool:
+    """
+    Posts for one canonical query, held once and shared by every consumer. The
+    pool is a bounded window over the query's result stream
+    """
+
+    query: str
+    stream: PagedResultStream
+    whitelist: FrozenSet[str] = field(init=False)
+    blacklist: FrozenSet[str] = field(init=False)
+    posts: List["Rule34Post"] = field(default_factory=list)
+    cursors: Dict[str, SamplingCursor] = field(default_factory=dict)
+
+    # lazily built tag id -> bitset of post indices, only for filtered tags
+    tag_bits: Dict[int, int] = field(default_factory=dict)
+    indexed: int = 0
+    # vocabulary table the posts and tag_bits are encoded with
+    tag_table: List[str] = field(default_factory=lambda: TAG_VOCABULARY.table)
+
+    # set on pools that replaced a full window, earlier results are not held
+    windowed: bool = False
+
+    # unix timestamp after which the pool is dropped from the cache
+    expires_at: float = 0.0
+
+    def __post_init__(self) -> None:
+        tag_group = TagGroup.from_string(self.query)
+        self.whitelist = frozenset(tag_group.whitelisted)
+        self.blacklist = frozenset(tag_group.blacklisted)
+
+    def __len__(self) -> int:
+        return len(self.posts)
+
+    @property
+    def complete(self) -> bool:
+        """
+        Whether the pool holds every reachable result of its query
+        """
+
+        return self.stream.finished and not self.windowed
+
+    def can_extend(self, max_size: int) -> bool:
+        return not self.stream.finished and len(self) < max_size
+
+    def extend(self, posts: List["Rule34Post"]) -> None:
+        # new uploads shift pages, so pages can overlap each other
+        known_ids = {post.id for post in self.posts}
+        self.posts.extend(post for post in posts if post.id not in known_ids)
+
+        # posts fetched before a compaction may arrive after it
+        self.adopt_vocabulary()
+        for post in posts:
+            post.adopt_vocabulary()
+
+    def adopt_vocabulary(self) -> None:
+        """
+        Re-encodes the posts into the current vocabulary table after a
+        compaction, tag ids indexed so far are dropped
+        """
+
+        if self.tag_table is TAG_VOCABULARY.table:
+            return
+
+        for post in self.posts:
+            post.adopt_vocabulary()
+        self.tag_bits.clear()
+        self.indexed = 0
+        self.tag_table = TAG_VOCABULARY.table
+
+    def to_state(self) -> Dict[str, Any]:
+        return {
+            "posts": [post.to_dict() for post in self.posts],
+            "stream": self.stream.to_state(),
+            "windowed": self.windowed,
+        }
+
+    def cursor(self, consumer: str) -> SamplingCursor:
+        if (cursor := self.cursors.get(consumer)) is None:
+            cursor = self.cursors[consumer] = SamplingCursor()
+        return cursor
+
+    def _index_tags(self, tag_ids: Set[int], start: int) -> None:
+        for tag_id in tag_ids:
+            self.tag_bits.setdefault(tag_id, 0)
+
+        for index in range(start, len(self.posts)):
+            for tag_id in self.posts[index].tag_ids:
+                if tag_id in tag_ids:
+                    self.tag_bits[tag_id] |= 1 << index
+
+    def _ensure_indexed(self, tag_ids: Collection[int]) -> None:
+        missing = {tag_id for tag_id in tag_ids if tag_id not in self.tag_bits}
+        if self.indexed < len(self.posts) and len(self.tag_bits) > 0:
+            # catch already indexed tags up with posts appended since
+            self._index_tags(set(self.tag_bits), self.indexed)
+        if missing:
+            self._index_tags(missing, 0)
+        self.indexed = len(self.posts)
+
+    def tag_mask(self, tag_ids: Collection[int]) -> int:
+        """
+        Bitset of the posts carrying any of the given tags
+        """
+
+        if not tag_ids:
+            return 0
+
+        self._ensure_indexed(tag_ids)
+
+        mask = 0
+        for tag_id in tag_ids:
+            mask |= self.tag_bits[tag_id]
+        return mask
+
+    def required_mask(self, tag_ids: Collection[int]) -> int:
+        """
+        Bitset of the posts carrying all of the given tags
+        """
+
+        if not tag_ids:
+            return -1
+
+        self._ensure_indexed(tag_ids)
+
+        mask = -1
+        for tag_id in tag_ids:
+            mask &= self.tag_bits[tag_id]
+        return mask
+
+    def exclusion_mask(
+        self, excluded_tags: Collection[int], required_tags: Collection[int] = ()
+    ) -> int:
+        # filters are looked up in the current table
+        self.adopt_vocabulary()
+        return self.tag_mask(excluded_tags) | ~self.required_mask(required_tags)
+
+    def count_eligible(
+        self, excluded_tags: Collection[int], required_tags: Collection[int] = ()
+    ) -> int:
+        excluded = self.exclusion_mask(excluded_tags, required_tags)
+        return len(self.posts) - (excluded & ((1 << len(self.posts)) - 1)).bit_count()
+
+    def subsumes(self, tags: TagGroup) -> bool:
+        """
+        Whether the tag group is a strictly narrower query than this pool's
+        whose extra tags can be checked against the posts locally
+        """
+
+        extra_whitelist = set(tags.whitelisted) - self.whitelist
+        extra_blacklist = set(tags.blacklisted) - self.blacklist
+
+        return (
+            self.whitelist.issubset(tags.whitelisted)
+            and self.blacklist.issubset(tags.blacklisted)
+            and len(extra_whitelist) + len(extra_blacklist) > 0
+            and not any(":" in tag for tag in extra_whitelist | extra_blacklist)
+        )
+
+    def draw(
+        self,
+        consumer: str,
+        reset: bool = False,
+        excluded_tags: Collection[int] = (),
+        required_tags: Collection[int] = (),
+        skip: Optional[Callable[["Rule34Post"], bool]] = None,
+    ) -> Optional["Rule34Post"]:
+        """
+        Draws a post the consumer has not seen yet that carries all required and
+        none of the excluded tags, when everything was seen the cursor starts
+        over if `reset` is set or the pool already holds every result. Posts
+        matching `skip` are only drawn when nothing else is left after a reset
+        """
+
+        cursor = self.cursor(consumer)
+        excluded = self.exclusion_mask(excluded_tags, required_tags)
+        skip_index = (lambda i: skip(self.posts[i])) if skip is not None else None
+        index = cursor.draw(len(self.posts), excluded, skip_index)
+
+        if index is None and (reset or self.complete):
+            cursor.reset()
+            index = cursor.draw(len(self.posts), excluded, skip_index)
+            if index is None and skip_index is not None:
+                # a repeat beats no post at all
+                index = cursor.draw(len(self.posts), excluded)
+
+        return self.posts[index] if index is not None else None
@@ -0,0 +1,53 @@
+from array import array
+from typing import Final
+
+
+class RecentlySeen:
+    """
+    Bounded ring of the post ids last shown to a viewer, the oldest id is
+    forgotten once the ring is full. Lookups go through a counting filter of
+    one byte counters and only scan the ring when it matches, so a viewer
+    costs 12 bytes per id of capacity
+    """
+
+    TYPECODE: Final[str] = "Q"
+    # filter counters per id of capacity, a full ring matches ~22% of misses
+    FILTER_RATIO: Final[int] = 4
+    # saturated counters are never decremented again, they only cost scans
+    MAX_COUNT: Final[int] = 255
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._ring = array(self.TYPECODE)
+        self._counts = bytearray(max(1, capacity * self.FILTER_RATIO))
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self._ring)
+
+    def _contains(self, value: int) -> bool:
+        return bool(self._counts[value % len(self._counts)]) and value in self._ring
+
+    def __contains__(self, post_id: str) -> bool:
+        return post_id.isdigit() and self._contains(int(post_id))
+
+    def add(self, post_id: str) -> None:
+        if not post_id.isdigit():
+            return
+
+        value = int(post_id)
+        if self._contains(value):
+            return
+
+        if len(self._ring) < self.capacity:
+            self._ring.append(value)
+        else:
+            slot = self._ring[self._next] % len(self._counts)
+            if self._counts[slot] < self.MAX_COUNT:
+                self._counts[slot] -= 1
+            self._ring[self._next] = value
+            self._next = (self._next + 1) % self.capacity
+
+        slot = value % len(self._counts)
+        if self._counts[slot] < self.MAX_COUNT:
+            self._counts[slot] += 1
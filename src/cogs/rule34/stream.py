@@ -0,0 +1,134 @@
+import random
+from math import ceil
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Final,
+    List,
+    Optional,
+    Tuple,
+)
+
+if TYPE_CHECKING:
+    from cogs.rule34.api import Rule34Post
+
+# a page of posts and the query's total number of results, when reported
+Page = Tuple[List["Rule34Post"], Optional[int]]
+FetchPage = Callable[[str, int, int], Awaitable[Page]]
+
+
+class PagedResultStream:
+    """
+    Lazily pages through every result of a query in random page order, one
+    page per iteration, so no more than a page is ever held by the stream. The
+    first pass starts on the first page, which reports the total the order of
+    the remaining pages is planned from
+    """
+
+    # the upstream refuses offsets past this many results
+    MAX_RESULT_OFFSET: Final[int] = 200_000
+
+    def __init__(
+        self,
+        query: str,
+        limit: int,
+        fetch_page: FetchPage,
+    ) -> None:
+        self.query = query
+        self.limit = limit
+        self.total: Optional[int] = None
+
+        self._fetch_page = fetch_page
+        self._order: Optional[List[int]] = None
+        self._position = 0
+
+    @classmethod
+    def from_state(
+        cls,
+        query: str,
+        state: Dict[str, Any],
+        fetch_page: FetchPage,
+    ) -> "PagedResultStream":
+        stream = cls(query, state["limit"], fetch_page)
+        stream.total = state["total"]
+        stream._order = state["order"]
+        stream._position = state["position"]
+        return stream
+
+    def to_state(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "total": self.total,
+            "order": self._order,
+            "position": self._position,
+        }
+
+    @property
+    def page_count(self) -> Optional[int]:
+        if self.total is None:
+            return None
+        reachable = min(self.total, self.MAX_RESULT_OFFSET)
+        return ceil(reachable / self.limit)
+
+    @property
+    def finished(self) -> bool:
+        return self._order is not None and self._position >= len(self._order)
+
+    def _plan(self, served: Optional[int] = None) -> None:
+        """
+        Orders the pages of a new pass, `served` was fetched to learn the total
+        and stays first
+        """
+
+        if (page_count := self.page_count) is not None:
+            pages = [page for page in range(page_count) if page != served]
+            self._order = random.sample(pages, len(pages))
+        else:
+            # unknown size, walk pages in order until a short page shows up
+            pages = range(ceil(self.MAX_RESULT_OFFSET / self.limit))
+            self._order = [page for page in pages if page != served]
+
+        if served is not None:
+            self._order.insert(0, served)
+        self._position = 0
+
+    def restart(self) -> None:
+        """
+        Starts a new pass with a fresh page order, planned from the total the
+        last pass reported
+        """
+
+        self._order = None
+        self._position = 0
+
+    def __aiter__(self) -> "PagedResultStream":
+        return self
+
+    async def __anext__(self) -> List["Rule34Post"]:
+        if self._order is None and self.total is not None:
+            self._plan()
+
+        if self._order is None:
+            # the total only arrives with a page, so the first pass starts on
+            # the first page instead of asking for the count separately
+            posts, self.total = await self._fetch_page(self.query, self.limit, 0)
+            self._plan(served=0)
+        else:
+            if self.finished:
+                raise StopAsyncIteration
+
+            page = self._order[self._position]
+            posts, total = await self._fetch_page(self.query, self.limit, page)
+            if total is not None:
+                self.total = total
+
+        assert self._order is not None
+        self._position += 1
+
+        if self.total is None and len(posts) < self.limit:
+            self._position = len(self._order)
+
+        return posts
@@ -1,5 +1,5 @@
 from dataclasses import dataclass, field
-from typing import List, Optional, Set
+from typing import Iterable, List, Optional, Set
 
 
 @dataclass
@@ -10,7 +10,12 @@ class TagGroup:
 
     @staticmethod
     def _normalize_tag(tag: str) -> str:
-        return tag.strip().lower().replace("-", "")
+        # only a leading `-` is negation syntax, tags like `x-men` keep theirs
+        return tag.strip().lower().lstrip("-")
+
+    @classmethod
+    def normalize_tags(cls, tags: Iterable[str]) -> Set[str]:
+        return {cls._normalize_tag(tag) for tag in tags if tag.strip()}
 
     @classmethod
     def from_list(
@@ -19,25 +24,33 @@ class TagGroup:
         blacklisted: List[str] | Set[str],
         additional_key: Optional[str] = None,
     ) -> "TagGroup":
-        whitelisted = [cls._normalize_tag(tag) for tag in whitelisted]
-        blacklisted = [cls._normalize_tag(tag) for tag in blacklisted]
-        return cls(whitelisted, blacklisted, additional_key)
+        return cls(
+            sorted(cls.normalize_tags(whitelisted)),
+            sorted(cls.normalize_tags(blacklisted)),
+            additional_key,
+        )
 
     @classmethod
     def from_string(cls, tags: str, additional_key: Optional[str] = None) -> "TagGroup":
         if not tags or not tags.strip():
-            return cls()
+            return cls(additional_key=additional_key)
 
-        normalized_tags = tags.strip().lower().replace(",", " ")
-        tag_list = [tag.strip() for tag in normalized_tags.split() if tag.strip()]
+        tag_list = tags.replace(",", " ").split()
 
-        blacklisted = sorted([tag[1:] for tag in tag_list if tag.startswith("-")])
-        whitelisted = sorted([tag for tag in tag_list if not tag.startswith("-")])
-
-        return cls(whitelisted, blacklisted, additional_key)
+        return cls.from_list(
+            [tag for tag in tag_list if not tag.startswith("-")],
+            [tag for tag in tag_list if tag.startswith("-")],
+            additional_key,
+        )
 
     def to_string(self) -> str:
-        all_tags = self.whitelisted + [f"-{tag}" for tag in self.blacklisted]
+        """
+        Canonical form of the query, equivalent tag groups produce equal strings
+        """
+
+        all_tags = sorted(set(self.whitelisted)) + [
+            f"-{tag}" for tag in sorted(set(self.blacklisted))
+        ]
         return " ".join(all_tags)
 
     def to_key(self) -> str:
@@ -1,33 +1,36 @@
-import asyncio
-from cachetools import TTLCache
-from sqlmodel import select
-from typing import Final, List, Optional, Set
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import SQLModel, delete, select
+from typing import Any, Dict, Final, List, Optional, Set, Type
 from uuid import UUID
 
 from db.engine import get_session
+from db.invalidation import InvalidationBus
 from db.models import (
+    R34CachedPostPool,
     R34UserProfile,
     R34UserBlacklist,
     R34UserBookmarks,
+    now,
 )
 from db.utils import DatabaseUtils
+from utils.cache import AsyncCache
 
 
 class Rule34DatabaseUtils(DatabaseUtils):
-    _r34_profile_cache: Final[TTLCache[UUID, R34UserProfile]] = TTLCache(
-        DatabaseUtils.maxsize, DatabaseUtils.ttl
+    # rows per bulk statement, keeps bound parameters well under sqlite's limit
+    bulk_batch_size: Final[int] = 1000
+
+    _r34_profile_cache: Final[AsyncCache[UUID, R34UserProfile]] = AsyncCache(
+        "r34_profile", DatabaseUtils.maxsize, DatabaseUtils.ttl
     )
-    _r34_profile_cache_lock = asyncio.Lock()
 
-    _blacklist_cache: Final[TTLCache[UUID, Set[str]]] = TTLCache(
-        DatabaseUtils.maxsize, DatabaseUtils.ttl
+    _blacklist_cache: Final[AsyncCache[UUID, Set[str]]] = AsyncCache(
+        "r34_blacklist", DatabaseUtils.maxsize, DatabaseUtils.ttl
     )
-    _blacklist_cache_lock = asyncio.Lock()
 
-    _bookmark_cache: Final[TTLCache[UUID, Set[str]]] = TTLCache(
-        DatabaseUtils.maxsize, DatabaseUtils.ttl
+    _bookmark_cache: Final[AsyncCache[UUID, Set[str]]] = AsyncCache(
+        "r34_bookmark", DatabaseUtils.maxsize, DatabaseUtils.ttl
     )
-    _bookmark_cache_lock = asyncio.Lock()
 
     @staticmethod
     async def _get_profile_id(guild_id: str, user_id: str) -> UUID:
@@ -42,34 +45,37 @@ class Rule34DatabaseUtils(DatabaseUtils):
     ) -> Optional[R34UserProfile]:
         profile_id = await Rule34DatabaseUtils._get_profile_id(guild_id, user_id)
 
-        async with Rule34DatabaseUtils._r34_profile_cache_lock:
-            if profile := Rule34DatabaseUtils._r34_profile_cache.get(profile_id):
-                return profile
-
-        async with get_session() as session:
-            result = await session.execute(
-                select(R34UserProfile).where(R34UserProfile.user_id == profile_id)
-            )
-            profile = result.scalar_one_or_none()
-
-            if profile:
-                async with Rule34DatabaseUtils._r34_profile_cache_lock:
-                    Rule34DatabaseUtils._r34_profile_cache[profile_id] = profile
+        async def load() -> Optional[R34UserProfile]:
+            async with get_session() as session:
+                result = await session.execute(
+                    select(R34UserProfile).where(R34UserProfile.user_id == profile_id)
+                )
+                return result.scalar_one_or_none()
 
-            return profile
+        return await Rule34DatabaseUtils._r34_profile_cache.get_or_load(
+            profile_id, load
+        )
 
     @staticmethod
     async def create_r34_user_profile(guild_id: str, user_id: str) -> R34UserProfile:
         profile_id = await Rule34DatabaseUtils._get_profile_id(guild_id, user_id)
-        profile = R34UserProfile(user_id=profile_id)
 
+        # concurrent first commands of a user may both get here, the later
+        # insert is a no-op and both read the same row back
         async with get_session() as session:
-            session.add(profile)
+            await session.execute(
+                sqlite_insert(R34UserProfile)
+                .values(user_id=profile_id, blacklist_enabled=True)
+                .on_conflict_do_nothing()
+            )
             await session.commit()
-            await session.refresh(profile)
 
-        async with Rule34DatabaseUtils._r34_profile_cache_lock:
-            Rule34DatabaseUtils._r34_profile_cache[profile_id] = profile
+            result = await session.execute(
+                select(R34UserProfile).where(R34UserProfile.user_id == profile_id)
+            )
+            profile = result.scalar_one()
+
+        Rule34DatabaseUtils._r34_profile_cache.set(profile_id, profile)
 
         return profile
 
@@ -97,112 +103,169 @@ class Rule34DatabaseUtils(DatabaseUtils):
                 setattr(profile, key, value)
 
             session.add(profile)
+            InvalidationBus.publish(
+                session, Rule34DatabaseUtils._r34_profile_cache, profile_id
+            )
             await session.commit()
             await session.refresh(profile)
 
-        async with Rule34DatabaseUtils._r34_profile_cache_lock:
-            Rule34DatabaseUtils._r34_profile_cache[profile_id] = profile
+        Rule34DatabaseUtils._r34_profile_cache.set(profile_id, profile)
 
         return profile
 
     @staticmethod
-    async def get_blacklist(guild_id: str, user_id: str) -> Set[str]:
-        profile_id = await Rule34DatabaseUtils._get_profile_id(guild_id, user_id)
+    async def _bulk_insert(
+        model: Type[SQLModel],
+        profile_id: UUID,
+        rows: List[Dict[str, Any]],
+        column: Any,
+        cache: AsyncCache,
+    ) -> Set[str]:
+        """
+        Inserts the profile's rows with INSERT .. ON CONFLICT DO NOTHING
+        RETURNING and reports the values of `column` that were actually
+        inserted, other processes drop the profile from `cache` if any were
+        """
+
+        inserted: Set[str] = set()
+        if not rows:
+            return inserted
 
-        async with Rule34DatabaseUtils._bookmark_cache_lock:
-            if cached := Rule34DatabaseUtils._blacklist_cache.get(profile_id):
-                return cached
+        batch_size = Rule34DatabaseUtils.bulk_batch_size
 
         async with get_session() as session:
-            result = await session.execute(
-                select(R34UserBlacklist.tag).where(
-                    R34UserBlacklist.user_id == profile_id
+            for i in range(0, len(rows), batch_size):
+                result = await session.execute(
+                    sqlite_insert(model)
+                    .values(rows[i : i + batch_size])
+                    .on_conflict_do_nothing()
+                    .returning(column)
                 )
-            )
-            tags = result.scalars().all()
-            tags = set(tags)
+                inserted.update(result.scalars().all())
 
-        async with Rule34DatabaseUtils._bookmark_cache_lock:
-            Rule34DatabaseUtils._blacklist_cache[profile_id] = tags
+            if inserted:
+                InvalidationBus.publish(session, cache, profile_id)
+            await session.commit()
 
-        return tags
+        return inserted
 
     @staticmethod
-    async def add_blacklist_tags(
-        guild_id: str, user_id: str, tags: List[str]
+    async def _bulk_delete(
+        model: Type[SQLModel],
+        owner_column: Any,
+        profile_id: UUID,
+        column: Any,
+        values: Set[str],
+        cache: AsyncCache,
     ) -> Set[str]:
-        profile_id = await Rule34DatabaseUtils._get_profile_id(guild_id, user_id)
+        """
+        Deletes the rows `owner_column` assigns to the profile whose `column`
+        is in `values` with DELETE .. WHERE .. IN (..) RETURNING and reports
+        the deleted values, other processes drop the profile from `cache` if
+        any were
+        """
 
-        existing_tags = await Rule34DatabaseUtils.get_blacklist(guild_id, user_id)
-        to_insert = set(tags) - existing_tags
-        rejected = set(tags) - to_insert
+        deleted: Set[str] = set()
+        if not values:
+            return deleted
+
+        ordered = list(values)
+        batch_size = Rule34DatabaseUtils.bulk_batch_size
 
         async with get_session() as session:
-            session.add_all(
-                [R34UserBlacklist(user_id=profile_id, tag=tag) for tag in to_insert]
-            )
+            for i in range(0, len(ordered), batch_size):
+                result = await session.execute(
+                    delete(model)
+                    .where(
+                        (owner_column == profile_id)
+                        & column.in_(ordered[i : i + batch_size])
+                    )
+                    .returning(column)
+                )
+                deleted.update(result.scalars().all())
+
+            if deleted:
+                InvalidationBus.publish(session, cache, profile_id)
             await session.commit()
 
-        async with Rule34DatabaseUtils._bookmark_cache_lock:
-            if profile_id in Rule34DatabaseUtils._blacklist_cache:
-                Rule34DatabaseUtils._blacklist_cache[profile_id].update(to_insert)
-            else:
-                Rule34DatabaseUtils._blacklist_cache[profile_id] = (
-                    existing_tags | to_insert
+        return deleted
+
+    @staticmethod
+    async def get_blacklist(guild_id: str, user_id: str) -> Set[str]:
+        profile_id = await Rule34DatabaseUtils._get_profile_id(guild_id, user_id)
+
+        async def load() -> Set[str]:
+            async with get_session() as session:
+                result = await session.execute(
+                    select(R34UserBlacklist.tag).where(
+                        R34UserBlacklist.user_id == profile_id
+                    )
                 )
+                return set(result.scalars().all())
 
-        return rejected
+        tags = await Rule34DatabaseUtils._blacklist_cache.get_or_load(profile_id, load)
+        return tags or set()
 
     @staticmethod
-    async def remove_blacklist_tags(
+    async def add_blacklist_tags(
         guild_id: str, user_id: str, tags: List[str]
     ) -> Set[str]:
         profile_id = await Rule34DatabaseUtils._get_profile_id(guild_id, user_id)
 
-        found_tags = set()
+        requested = set(tags)
+        inserted = await Rule34DatabaseUtils._bulk_insert(
+            R34UserBlacklist,
+            profile_id,
+            [{"user_id": profile_id, "tag": tag} for tag in requested],
+            R34UserBlacklist.tag,
+            Rule34DatabaseUtils._blacklist_cache,
+        )
 
-        async with get_session() as session:
-            for tag in tags:
-                result = await session.execute(
-                    select(R34UserBlacklist).where(
-                        (R34UserBlacklist.user_id == profile_id)
-                        & (R34UserBlacklist.tag == tag)
-                    )
-                )
-                record = result.scalar_one_or_none()
-                if record:
-                    await session.delete(record)
-                    found_tags.add(tag)
+        Rule34DatabaseUtils._blacklist_cache.update(
+            profile_id, lambda cached: cached.update(inserted)
+        )
 
-            await session.commit()
+        return requested - inserted
 
-        async with Rule34DatabaseUtils._bookmark_cache_lock:
-            if profile_id in Rule34DatabaseUtils._blacklist_cache:
-                Rule34DatabaseUtils._blacklist_cache[profile_id] -= found_tags
+    @staticmethod
+    async def remove_blacklist_tags(
+        guild_id: str, user_id: str, tags: List[str]
+    ) -> Set[str]:
+        profile_id = await Rule34DatabaseUtils._get_profile_id(guild_id, user_id)
 
-        rejected = set(tags) - found_tags
-        return rejected
+        requested = set(tags)
+        found_tags = await Rule34DatabaseUtils._bulk_delete(
+            R34UserBlacklist,
+            R34UserBlacklist.user_id,
+            profile_id,
+            R34UserBlacklist.tag,
+            requested,
+            Rule34DatabaseUtils._blacklist_cache,
+        )
+
+        Rule34DatabaseUtils._blacklist_cache.update(
+            profile_id, lambda cached: cached.difference_update(found_tags)
+        )
+
+        return requested - found_tags
 
     @staticmethod
     async def get_bookmarks(guild_id: str, user_id: str) -> Set[str]:
         profile_id = await Rule34DatabaseUtils._get_profile_id(guild_id, user_id)
 
-        async with Rule34DatabaseUtils._bookmark_cache_lock:
-            if cached := Rule34DatabaseUtils._bookmark_cache.get(profile_id):
-                return cached
-
-        async with get_session() as session:
-            result = await session.execute(
-                select(R34UserBookmarks.post_id).where(
-                    R34UserBookmarks.user_id == profile_id
+        async def load() -> Set[str]:
+            async with get_session() as session:
+                result = await session.execute(
+                    select(R34UserBookmarks.post_id).where(
+                        R34UserBookmarks.user_id == profile_id
+                    )
                 )
-            )
-            post_ids = set(result.scalars().all())
+                return set(result.scalars().all())
 
-        async with Rule34DatabaseUtils._bookmark_cache_lock:
-            Rule34DatabaseUtils._bookmark_cache[profile_id] = post_ids
-
-        return post_ids
+        post_ids = await Rule34DatabaseUtils._bookmark_cache.get_or_load(
+            profile_id, load
+        )
+        return post_ids or set()
 
     @staticmethod
     async def add_bookmarks(
@@ -210,25 +273,24 @@ class Rule34DatabaseUtils(DatabaseUtils):
     ) -> Set[str]:
         profile_id = await Rule34DatabaseUtils._get_profile_id(guild_id, user_id)
 
-        existing_post_ids = await Rule34DatabaseUtils.get_bookmarks(guild_id, user_id)
-        to_insert = set(post_ids) - existing_post_ids
-        rejected = set(post_ids) - to_insert
-
-        async with get_session() as session:
-            session.add_all(
-                [R34UserBookmarks(user_id=profile_id, post_id=pid) for pid in to_insert]
-            )
-            await session.commit()
+        requested = set(post_ids)
+        created_at = now()
+        inserted = await Rule34DatabaseUtils._bulk_insert(
+            R34UserBookmarks,
+            profile_id,
+            [
+                {"user_id": profile_id, "post_id": pid, "created_at": created_at}
+                for pid in requested
+            ],
+            R34UserBookmarks.post_id,
+            Rule34DatabaseUtils._bookmark_cache,
+        )
 
-        async with Rule34DatabaseUtils._bookmark_cache_lock:
-            if profile_id in Rule34DatabaseUtils._bookmark_cache:
-                Rule34DatabaseUtils._bookmark_cache[profile_id].update(to_insert)
-            else:
-                Rule34DatabaseUtils._bookmark_cache[profile_id] = (
-                    existing_post_ids | to_insert
-                )
+        Rule34DatabaseUtils._bookmark_cache.update(
+            profile_id, lambda cached: cached.update(inserted)
+        )
 
-        return rejected
+        return requested - inserted
 
     @staticmethod
     async def remove_bookmarks(
@@ -236,26 +298,65 @@ class Rule34DatabaseUtils(DatabaseUtils):
     ) -> Set[str]:
         profile_id = await Rule34DatabaseUtils._get_profile_id(guild_id, user_id)
 
-        found_post_ids = set()
+        requested = set(post_ids)
+        found_post_ids = await Rule34DatabaseUtils._bulk_delete(
+            R34UserBookmarks,
+            R34UserBookmarks.user_id,
+            profile_id,
+            R34UserBookmarks.post_id,
+            requested,
+            Rule34DatabaseUtils._bookmark_cache,
+        )
+
+        Rule34DatabaseUtils._bookmark_cache.update(
+            profile_id, lambda cached: cached.difference_update(found_post_ids)
+        )
+
+        return requested - found_post_ids
 
+    @staticmethod
+    async def fetch_post_pool(query: str) -> Optional[R34CachedPostPool]:
         async with get_session() as session:
-            for pid in post_ids:
-                result = await session.execute(
-                    select(R34UserBookmarks).where(
-                        (R34UserBookmarks.user_id == profile_id)
-                        & (R34UserBookmarks.post_id == pid)
-                    )
+            result = await session.execute(
+                select(R34CachedPostPool).where(R34CachedPostPool.query == query)
+            )
+            return result.scalar_one_or_none()
+
+    @staticmethod
+    async def save_post_pool(query: str, payload: str, expires_at: float) -> None:
+        stmt = sqlite_insert(R34CachedPostPool).values(
+            query=query, payload=payload, expires_at=expires_at
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["query"],
+            set_={"payload": stmt.excluded.payload, "expires_at": expires_at},
+        )
+
+        async with get_session() as session:
+            await session.execute(stmt)
+            await session.commit()
+
+    @staticmethod
+    async def delete_post_pool(query: str) -> None:
+        async with get_session() as session:
+            await session.execute(
+                delete(R34CachedPostPool).where(
+                    R34CachedPostPool.query == query  # type: ignore
                 )
-                record = result.scalar_one_or_none()
-                if record:
-                    await session.delete(record)
-                    found_post_ids.add(pid)
+            )
+            await session.commit()
 
+    @staticmethod
+    async def purge_expired_post_pools(now: float) -> None:
+        async with get_session() as session:
+            await session.execute(
+                delete(R34CachedPostPool).where(
+                    R34CachedPostPool.expires_at <= now  # type: ignore
+                )
+            )
             await session.commit()
 
-        async with Rule34DatabaseUtils._bookmark_cache_lock:
-            if profile_id in Rule34DatabaseUtils._bookmark_cache:
-                Rule34DatabaseUtils._bookmark_cache[profile_id] -= found_post_ids
 
-        rejected = set(post_ids) - found_post_ids
-        return rejected
+InvalidationBus.subscribe(Rule34DatabaseUtils._r34_profile_cache, UUID)
+InvalidationBus.subscribe(Rule34DatabaseUtils._blacklist_cache, UUID)
+InvalidationBus.subscribe(Rule34DatabaseUtils._bookmark_cache, UUID)
@@ -0,0 +1,60 @@
+from array import array
+from typing import Callable, Dict, Final, Iterable, List, Optional, Set
+
+
+class TagVocabulary:
+    """
+    Interns tag strings into dense integer ids so posts can store their tags as
+    a compact array instead of a list of string objects. Ids index the table
+    they were issued from, compacting starts a new table holding only the tags
+    still in use while holders of the old one keep decoding through it
+    """
+
+    TYPECODE: Final[str] = "I"
+    # tables smaller than this are never compacted
+    MIN_COMPACTION_SIZE: Final[int] = 1 << 16
+
+    def __init__(self) -> None:
+        self._ids: Dict[str, int] = {}
+        self._tags: List[str] = []
+        # tags left in the table by the last compaction
+        self._live = 0
+
+    def __len__(self) -> int:
+        return len(self._tags)
+
+    @property
+    def table(self) -> List[str]:
+        return self._tags
+
+    def id_of(self, tag: str) -> int:
+        if (tag_id := self._ids.get(tag)) is None:
+            tag_id = len(self._tags)
+            self._ids[tag] = tag_id
+            self._tags.append(tag)
+        return tag_id
+
+    def lookup(self, tag: str) -> Optional[int]:
+        return self._ids.get(tag)
+
+    def known_ids(self, tags: Iterable[str]) -> Set[int]:
+        return {tag_id for tag in tags if (tag_id := self._ids.get(tag)) is not None}
+
+    def encode(self, tags: Iterable[str]) -> array:
+        return array(self.TYPECODE, [self.id_of(tag) for tag in tags])
+
+    def needs_compaction(self) -> bool:
+        return len(self._tags) > max(self.MIN_COMPACTION_SIZE, 2 * self._live)
+
+    def compact(self, adopt: Callable[[], None]) -> None:
+        """
+        Starts a new table and lets `adopt` re-encode everything still in use
+        into it, ids issued before are only valid with the old table
+        """
+
+        self._ids, self._tags = {}, []
+        adopt()
+        self._live = len(self._tags)
+
+
+TAG_VOCABULARY: Final[TagVocabulary] = TagVocabulary()
@@ -0,0 +1,81 @@
+from discord.ext import commands
+
+from typing import Final, Optional
+
+from utils.cache import cache_snapshot
+from utils.formatter import Formatter as Fmt
+from utils.tracing import Tracing
+
+
+class StatsCog(commands.Cog):
+    # leaves room for the code block around the table
+    MAX_REPLY_LENGTH: Final[int] = 1900
+
+    def __init__(self, client: commands.Bot) -> None:
+        self.client = client
+
+    async def cog_check(self, ctx: commands.Context) -> bool:
+        if not await self.client.is_owner(ctx.author):
+            raise commands.NotOwner("You do not own this bot.")
+        return True
+
+    @commands.group(name="stats", invoke_without_command=True)
+    async def stats_group(self, ctx: commands.Context) -> None:
+        await ctx.reply(
+            Fmt.info("Available subcommands\n\t+ cache\n\t+ latency [command]\n")
+        )
+
+    @stats_group.command(name="cache")
+    async def cache_stats(self, ctx: commands.Context) -> None:
+        lines = [
+            f"{'cache':<18} {'size':>11} {'hit%':>6} {'hits':>8} {'misses':>8} {'evict':>7} {'expire':>7}"
+        ]
+        for name, stats, size, maxsize in cache_snapshot():
+            lines.append(
+                f"{name:<18} {f'{size}/{maxsize}':>11} {stats.hit_ratio * 100:>5.1f}% "
+                f"{stats.hits:>8} {stats.misses:>8} {stats.evictions:>7} {stats.expirations:>7}"
+            )
+
+        await ctx.reply(Fmt.info("\n".join(lines)))
+
+    @stats_group.command(name="latency")
+    async def latency_stats(
+        self, ctx: commands.Context, *, command: Optional[str] = None
+    ) -> None:
+        lines = [
+            f"{'command':<22} {'span':<13} {'count':>6} {'p50':>8} {'p95':>8} {'p99':>8}"
+        ]
+        for name, span, histogram in Tracing.snapshot():
+            if command is not None and name != command:
+                continue
+
+            p50, p95, p99 = (histogram.percentile(q) * 1000 for q in (50, 95, 99))
+            lines.append(
+                f"{name:<22} {span:<13} {histogram.count:>6} "
+                f"{p50:>6.1f}ms {p95:>6.1f}ms {p99:>6.1f}ms"
+            )
+
+        if len(lines) == 1:
+            await ctx.reply(Fmt.info("No latencies recorded yet"))
+            return
+
+        # drop trailing rows that would not fit a single message
+        while len("\n".join(lines)) > self.MAX_REPLY_LENGTH:
+            lines.pop()
+
+        await ctx.reply(Fmt.info("\n".join(lines)))
+
+    async def cog_command_error(
+        self, ctx: commands.Context, error: commands.CommandError
+    ) -> None:
+        if isinstance(error, commands.NotOwner):
+            await ctx.reply(
+                Fmt.warning("This command can only be used by the bot owner")
+            )
+        else:
+            await ctx.reply(Fmt.error("An unexpected error occurred"))
+            raise error
+
+
+def setup(client: commands.Bot):
+    client.add_cog(StatsCog(client=client))
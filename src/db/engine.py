@@ -1,27 +1,82 @@
 from contextlib import asynccontextmanager
 from pathlib import Path
+from sqlalchemy import event, text
 from sqlmodel import SQLModel
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from typing import Final, AsyncGenerator
+from sqlalchemy.ext.asyncio import (
+    create_async_engine,
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+)
+from typing import Any, Final, AsyncGenerator
 
 import db.models
+from db.profiles import DEFAULT_STORAGE_PROFILE, STORAGE_PROFILES, StorageProfile
+from utils.tracing import Tracing
 
 db_path: Final[Path] = Path("database/bot.db").resolve()
-DATABASE_URL: Final[str] = f"sqlite+aiosqlite:///{db_path.as_posix()}"
 
-engine = create_async_engine(DATABASE_URL, echo=False)
+# stored in PRAGMA user_version, bump it whenever a table or index is added
+SCHEMA_VERSION: Final[int] = 1
+
+
+def create_engine(path: Path, profile: StorageProfile) -> AsyncEngine:
+    new_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{path.as_posix()}",
+        echo=False,
+        pool_size=profile.pool_size,
+        max_overflow=profile.max_overflow,
+        pool_timeout=profile.pool_timeout,
+    )
+
+    if profile.pragmas:
+
+        @event.listens_for(new_engine.sync_engine, "connect")
+        def apply_pragmas(dbapi_connection: Any, _connection_record: Any) -> None:
+            cursor = dbapi_connection.cursor()
+            for pragma, value in profile.pragmas.items():
+                cursor.execute(f"PRAGMA {pragma}={value}")
+            cursor.close()
+
+    return new_engine
+
+
+engine = create_engine(db_path, STORAGE_PROFILES[DEFAULT_STORAGE_PROFILE])
 
 async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
-async def init_db() -> None:
-    db_path.parent.mkdir(parents=True, exist_ok=True)
+async def configure_engine(profile: StorageProfile, path: Path = db_path) -> None:
+    """
+    Swaps the global engine for one using the given storage profile and path
+    """
+
+    global engine, async_session
+
+    await engine.dispose()
+
+    engine = create_engine(path, profile)
+    async_session = async_sessionmaker(
+        engine, class_=AsyncSession, expire_on_commit=False
+    )
+
+
+async def init_db(profile: str = DEFAULT_STORAGE_PROFILE, path: Path = db_path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    await configure_engine(STORAGE_PROFILES[profile], path)
 
     async with engine.begin() as conn:
+        result = await conn.execute(text("PRAGMA user_version"))
+        if result.scalar_one() == SCHEMA_VERSION:
+            return
+
         await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
 
 
 @asynccontextmanager
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
-    async with async_session() as session:
-        yield session
+    with Tracing.span("db"):
+        async with async_session() as session:
+            yield session
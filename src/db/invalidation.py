@@ -0,0 +1,145 @@
+import asyncio
+import time
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import delete, select
+from typing import Any, Callable, Dict, Final, Optional, Tuple
+from uuid import uuid4
+
+from db.engine import get_session
+from db.models import CacheInvalidation
+from utils.cache import AsyncCache
+
+
+class InvalidationBus:
+    """
+    Keeps caches coherent across bot processes sharing one database. Writers
+    append the cache keys they changed to a change log inside their own
+    transaction, every process polls the log and drops those keys locally
+    """
+
+    poll_interval: Final[float] = 1.0
+    # log entries older than this are purged, a process that could not poll
+    # for longer may have missed some and drops its subscribed caches instead
+    retention: Final[float] = 300.0
+    purge_interval: Final[float] = 60.0
+
+    # identifies this process's own entries, which need no local invalidation
+    origin: Final[str] = uuid4().hex
+
+    _subscriptions: Final[Dict[str, Tuple[AsyncCache, Callable[[str], Any]]]] = {}
+    _last_id: int = 0
+    _last_poll: float = 0.0
+    _last_purge: float = 0.0
+    _poll_task: Optional[asyncio.Task[None]] = None
+
+    @staticmethod
+    def subscribe(cache: AsyncCache, parse_key: Callable[[str], Any] = str) -> None:
+        """
+        Registers a cache to be invalidated by other processes, `parse_key`
+        turns the logged string back into the cache's key type
+        """
+
+        InvalidationBus._subscriptions[cache.name] = (cache, parse_key)
+
+    @staticmethod
+    def enabled() -> bool:
+        return InvalidationBus._poll_task is not None
+
+    @staticmethod
+    def publish(session: AsyncSession, cache: AsyncCache, key: Any) -> None:
+        """
+        Logs a changed key as part of the session's transaction, a no-op while
+        the bus is not running
+        """
+
+        if not InvalidationBus.enabled():
+            return
+
+        session.add(
+            CacheInvalidation(
+                cache=cache.name,
+                key=str(key),
+                origin=InvalidationBus.origin,
+                created_at=time.time(),
+            )
+        )
+
+    @staticmethod
+    def _clear_subscribed() -> None:
+        for cache, _ in InvalidationBus._subscriptions.values():
+            cache.clear()
+
+    @staticmethod
+    async def poll() -> None:
+        now = time.time()
+        if now - InvalidationBus._last_poll > InvalidationBus.retention:
+            InvalidationBus._clear_subscribed()
+
+        async with get_session() as session:
+            result = await session.execute(
+                select(CacheInvalidation)
+                .where(CacheInvalidation.id > InvalidationBus._last_id)  # type: ignore
+                .order_by(CacheInvalidation.id)  # type: ignore
+            )
+            entries = result.scalars().all()
+
+            if now - InvalidationBus._last_purge >= InvalidationBus.purge_interval:
+                await session.execute(
+                    delete(CacheInvalidation).where(
+                        CacheInvalidation.created_at < now - InvalidationBus.retention  # type: ignore
+                    )
+                )
+                await session.commit()
+                InvalidationBus._last_purge = now
+
+        for entry in entries:
+            InvalidationBus._last_id = entry.id or InvalidationBus._last_id
+            if entry.origin == InvalidationBus.origin:
+                continue
+
+            if subscription := InvalidationBus._subscriptions.get(entry.cache):
+                cache, parse_key = subscription
+                cache.invalidate(parse_key(entry.key))
+
+        InvalidationBus._last_poll = now
+
+    @staticmethod
+    async def _poll_loop(interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await InvalidationBus.poll()
+            except Exception as e:
+                print(f"Failed to poll cache invalidations: {e}")
+
+    @staticmethod
+    async def start(interval: float = poll_interval) -> None:
+        task = InvalidationBus._poll_task
+        if task is not None and not task.done():
+            return
+
+        # only changes made after startup matter, older ones predate our caches
+        async with get_session() as session:
+            result = await session.execute(
+                select(CacheInvalidation.id)
+                .order_by(CacheInvalidation.id.desc())  # type: ignore
+                .limit(1)
+            )
+            InvalidationBus._last_id = result.scalar_one_or_none() or 0
+
+        InvalidationBus._last_poll = time.time()
+        InvalidationBus._poll_task = asyncio.create_task(
+            InvalidationBus._poll_loop(interval)
+        )
+
+    @staticmethod
+    async def stop() -> None:
+        task = InvalidationBus._poll_task
+        InvalidationBus._poll_task = None
+
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
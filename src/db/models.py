@@ -2,6 +2,7 @@ from datetime import datetime, timezone
 from enum import Enum
 from sqlmodel import SQLModel, Field
 from sqlalchemy import Index
+from typing import Optional
 from uuid import UUID, uuid4
 
 
@@ -61,3 +62,20 @@ class R34UserBookmarks(SQLModel, table=True):
     user_id: UUID = Field(primary_key=True, foreign_key="guilduserprofile.id")
     post_id: str = Field(primary_key=True)
     created_at: datetime = Field(default_factory=now)
+
+
+class R34CachedPostPool(SQLModel, table=True):
+    query: str = Field(primary_key=True)
+    payload: str
+    expires_at: float = Field(index=True)
+
+
+class CacheInvalidation(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    cache: str
+    key: str
+    origin: str
+    created_at: float = Field(index=True)
+
+    # ids must never be reused after a purge, pollers track the last one seen
+    __table_args__ = {"sqlite_autoincrement": True}
@@ -0,0 +1,37 @@
+from dataclasses import dataclass, field
+from typing import Dict, Final
+
+
+@dataclass(frozen=True)
+class StorageProfile:
+    """
+    PRAGMAs applied to every new SQLite connection plus connection pool sizing
+    """
+
+    name: str
+    pragmas: Dict[str, str | int] = field(default_factory=dict)
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30.0
+
+
+STORAGE_PROFILES: Final[Dict[str, StorageProfile]] = {
+    # sqlite defaults, rollback journal with synchronous=FULL
+    "default": StorageProfile(name="default"),
+    "performance": StorageProfile(
+        name="performance",
+        pragmas={
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "mmap_size": 256 * 1024 * 1024,
+            "cache_size": -64 * 1024,  # negative values are KiB
+            "busy_timeout": 5000,
+            "temp_store": "MEMORY",
+        },
+        pool_size=8,
+        max_overflow=8,
+        pool_timeout=10.0,
+    ),
+}
+
+DEFAULT_STORAGE_PROFILE: Final[str] = "performance"
@@ -1,7 +1,9 @@
 import asyncio
-from cachetools import TTLCache
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
-from typing import Final, Optional
+from typing import Dict, Final, Optional, Tuple
+from uuid import UUID, uuid4
 
 from db.models import (
     User,
@@ -12,19 +14,33 @@ from db.models import (
     now,
 )
 from db.engine import get_session
+from db.invalidation import InvalidationBus
+from utils.cache import AsyncCache
 
 
 class DatabaseUtils:
     maxsize: Final[int] = 2048
     ttl: Final[int] = 3600
 
-    _guild_cache: Final[TTLCache[str, Guild]] = TTLCache(maxsize, ttl)
-    _guild_cache_lock = asyncio.Lock()
+    _guild_cache: Final[AsyncCache[str, Guild]] = AsyncCache("guild", maxsize, ttl)
 
-    _guild_user_profile_cache: Final[TTLCache[str, GuildUserProfile]] = TTLCache(
-        maxsize, ttl
+    _guild_user_profile_cache: Final[AsyncCache[str, GuildUserProfile]] = AsyncCache(
+        "guild_user_profile", maxsize, ttl
     )
-    _guild_user_profile_cache_lock = asyncio.Lock()
+
+    # keys of user / guild / profile combinations known to exist in the database
+    _registered_cache: Final[AsyncCache[str, bool]] = AsyncCache(
+        "registered", maxsize * 32
+    )
+
+    command_count_flush_interval: Final[int] = 30
+    command_count_flush_batch_size: Final[int] = 500
+
+    # write-behind buffer of command count increments not yet persisted
+    _command_count_buffer: Final[Dict[Tuple[UUID, CommandCategory], int]] = {}
+    _command_count_flushing: Final[Dict[Tuple[UUID, CommandCategory], int]] = {}
+    _command_count_flush_lock = asyncio.Lock()
+    _command_count_flush_task: Optional[asyncio.Task[None]] = None
 
     @staticmethod
     async def fetch_or_create_user(user_id: str) -> User:
@@ -41,19 +57,14 @@ class DatabaseUtils:
 
     @staticmethod
     async def fetch_guild(guild_id: str) -> Optional[Guild]:
-        async with DatabaseUtils._guild_cache_lock:
-            if guild := DatabaseUtils._guild_cache.get(guild_id):
-                return guild
-
-        async with get_session() as session:
-            result = await session.execute(select(Guild).where(Guild.id == guild_id))
-            guild = result.scalar_one_or_none()
-
-            if guild:
-                async with DatabaseUtils._guild_cache_lock:
-                    DatabaseUtils._guild_cache[guild_id] = guild
+        async def load() -> Optional[Guild]:
+            async with get_session() as session:
+                result = await session.execute(
+                    select(Guild).where(Guild.id == guild_id)
+                )
+                return result.scalar_one_or_none()
 
-            return guild
+        return await DatabaseUtils._guild_cache.get_or_load(guild_id, load)
 
     @staticmethod
     async def create_guild(guild_id: str) -> Guild:
@@ -64,8 +75,7 @@ class DatabaseUtils:
             await session.commit()
             await session.refresh(guild)
 
-        async with DatabaseUtils._guild_cache_lock:
-            DatabaseUtils._guild_cache[guild_id] = guild
+        DatabaseUtils._guild_cache.set(guild_id, guild)
         return guild
 
     @staticmethod
@@ -84,55 +94,55 @@ class DatabaseUtils:
                 setattr(guild, key, value)
 
             session.add(guild)
+            InvalidationBus.publish(session, DatabaseUtils._guild_cache, guild_id)
             await session.commit()
             await session.refresh(guild)
 
-        async with DatabaseUtils._guild_cache_lock:
-            if cached := DatabaseUtils._guild_cache.get(guild_id):
-                for key, value in kwargs.items():
-                    setattr(cached, key, value)
-            DatabaseUtils._guild_cache[guild_id] = guild
+        def apply(cached: Guild) -> None:
+            for key, value in kwargs.items():
+                setattr(cached, key, value)
+
+        DatabaseUtils._guild_cache.update(guild_id, apply)
+        DatabaseUtils._guild_cache.set(guild_id, guild)
         return guild
 
     @staticmethod
     async def fetch_guild_user_profile(
         guild_id: str, user_id: str
     ) -> Optional[GuildUserProfile]:
-        cache_key = f"{guild_id}:{user_id}"
-        async with DatabaseUtils._guild_user_profile_cache_lock:
-            if profile := DatabaseUtils._guild_user_profile_cache.get(cache_key):
-                return profile
-
-        async with get_session() as session:
-            result = await session.execute(
-                select(GuildUserProfile).where(
-                    (GuildUserProfile.guild_id == guild_id)
-                    & (GuildUserProfile.user_id == user_id)
+        async def load() -> Optional[GuildUserProfile]:
+            async with get_session() as session:
+                result = await session.execute(
+                    select(GuildUserProfile).where(
+                        (GuildUserProfile.guild_id == guild_id)
+                        & (GuildUserProfile.user_id == user_id)
+                    )
                 )
-            )
-            profile = result.scalar_one_or_none()
-            if profile:
-                async with DatabaseUtils._guild_user_profile_cache_lock:
-                    DatabaseUtils._guild_user_profile_cache[cache_key] = profile
-            return profile
+                return result.scalar_one_or_none()
+
+        return await DatabaseUtils._guild_user_profile_cache.get_or_load(
+            f"{guild_id}:{user_id}", load
+        )
 
     @staticmethod
     async def create_guild_user_profile(
         guild_id: str, user_id: str
     ) -> GuildUserProfile:
-        await DatabaseUtils.fetch_or_create_guild(guild_id)
-        await DatabaseUtils.fetch_or_create_user(user_id)
-
-        profile = GuildUserProfile(guild_id=guild_id, user_id=user_id, created_at=now())
-
         async with get_session() as session:
-            session.add(profile)
+            await DatabaseUtils._insert_registration(session, guild_id, user_id)
             await session.commit()
-            await session.refresh(profile)
+
+            result = await session.execute(
+                select(GuildUserProfile).where(
+                    (GuildUserProfile.guild_id == guild_id)
+                    & (GuildUserProfile.user_id == user_id)
+                )
+            )
+            profile = result.scalar_one()
 
         cache_key = f"{guild_id}:{user_id}"
-        async with DatabaseUtils._guild_user_profile_cache_lock:
-            DatabaseUtils._guild_user_profile_cache[cache_key] = profile
+        DatabaseUtils._registered_cache.set(cache_key, True)
+        DatabaseUtils._guild_user_profile_cache.set(cache_key, profile)
 
         return profile
 
@@ -144,6 +154,57 @@ class DatabaseUtils:
             guild_id, user_id
         ) or await DatabaseUtils.create_guild_user_profile(guild_id, user_id)
 
+    @staticmethod
+    async def _insert_registration(
+        session: AsyncSession, guild_id: Optional[str], user_id: str
+    ) -> None:
+        await session.execute(
+            sqlite_insert(User).values(id=user_id).on_conflict_do_nothing()
+        )
+
+        if guild_id is None:
+            return
+
+        await session.execute(
+            sqlite_insert(Guild)
+            .values(id=guild_id, r34_enabled=False, created_at=now())
+            .on_conflict_do_nothing()
+        )
+        await session.execute(
+            sqlite_insert(GuildUserProfile)
+            .values(id=uuid4(), guild_id=guild_id, user_id=user_id, created_at=now())
+            .on_conflict_do_nothing(index_elements=["guild_id", "user_id"])
+        )
+
+    @staticmethod
+    async def register(guild_id: Optional[str], user_id: str) -> None:
+        """
+        Ensures the user, guild and guild user profile rows exist using a single
+        transaction, already registered combinations skip the database entirely
+        """
+
+        cache = DatabaseUtils._registered_cache
+        cache_key = f"{guild_id}:{user_id}" if guild_id is not None else user_id
+        if cache.get(cache_key) is not None:
+            return
+
+        async with cache.lock(cache_key):
+            if cache_key in cache:
+                return
+
+            async with get_session() as session:
+                await DatabaseUtils._insert_registration(session, guild_id, user_id)
+                await session.commit()
+
+            cache.set(cache_key, True)
+            cache.set(user_id, True)
+
+    @staticmethod
+    def _pending_command_count(key: Tuple[UUID, CommandCategory]) -> int:
+        return DatabaseUtils._command_count_buffer.get(
+            key, 0
+        ) + DatabaseUtils._command_count_flushing.get(key, 0)
+
     @staticmethod
     async def fetch_command_count(
         guild_id: str, user_id: str, category: CommandCategory
@@ -152,43 +213,117 @@ class DatabaseUtils:
             guild_id, user_id
         )
 
-        async with get_session() as session:
-            result = await session.execute(
-                select(UserCommandCount.count).where(
-                    (UserCommandCount.user_id == profile.id)
-                    & (UserCommandCount.category == category)
+        # a flush moves increments into the database while it runs, reading
+        # between the two would miss or double count them
+        async with DatabaseUtils._command_count_flush_lock:
+            async with get_session() as session:
+                result = await session.execute(
+                    select(UserCommandCount.count).where(
+                        (UserCommandCount.user_id == profile.id)
+                        & (UserCommandCount.category == category)
+                    )
                 )
+                persisted = result.scalar_one_or_none() or 0
+
+            return persisted + DatabaseUtils._pending_command_count(
+                (profile.id, category)
             )
-            return result.scalar_one_or_none() or 0
 
     @staticmethod
     async def increment_command_count(
         guild_id: str, user_id: str, category: CommandCategory, amount: int = 1
-    ) -> int:
+    ) -> None:
+        """
+        Buffers the increment in memory, it is persisted by flush_command_counts
+        """
+
         profile = await DatabaseUtils.fetch_or_create_guild_user_profile(
             guild_id, user_id
         )
 
-        async with get_session() as session:
-            result = await session.execute(
-                select(UserCommandCount).where(
-                    (UserCommandCount.user_id == profile.id)
-                    & (UserCommandCount.category == category)
-                )
-            )
-            command_count = result.scalar_one_or_none()
+        key = (profile.id, category)
+        buffer = DatabaseUtils._command_count_buffer
+        buffer[key] = buffer.get(key, 0) + amount
 
-            if command_count:
-                command_count.count += amount
-                session.add(command_count)
-                await session.commit()
-                await session.refresh(command_count)
-                return command_count.count
+    @staticmethod
+    async def flush_command_counts() -> None:
+        async with DatabaseUtils._command_count_flush_lock:
+            buffer = DatabaseUtils._command_count_buffer
+            flushing = DatabaseUtils._command_count_flushing
+            if not buffer:
+                return
+
+            flushing.update(buffer)
+            buffer.clear()
+
+            rows = [
+                {"user_id": profile_id, "category": category, "count": count}
+                for (profile_id, category), count in flushing.items()
+            ]
+            batch_size = DatabaseUtils.command_count_flush_batch_size
+
+            try:
+                async with get_session() as session:
+                    for i in range(0, len(rows), batch_size):
+                        stmt = sqlite_insert(UserCommandCount).values(
+                            rows[i : i + batch_size]
+                        )
+                        stmt = stmt.on_conflict_do_update(
+                            index_elements=["user_id", "category"],
+                            set_={
+                                "count": UserCommandCount.count + stmt.excluded.count
+                            },
+                        )
+                        await session.execute(stmt)
+
+                    await session.commit()
+            except BaseException:
+                # put the increments back so the next flush retries them, also
+                # when the flusher is cancelled mid-write at shutdown
+                for key, count in flushing.items():
+                    buffer[key] = buffer.get(key, 0) + count
+                raise
+            finally:
+                flushing.clear()
 
-            new_count = amount
-            count_obj = UserCommandCount(
-                user_id=profile.id, category=category, count=new_count
-            )
-            session.add(count_obj)
-            await session.commit()
-            return new_count
+    @staticmethod
+    async def _command_count_flush_loop(interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await DatabaseUtils.flush_command_counts()
+            except Exception as e:
+                print(f"Failed to flush command counts: {e}")
+
+    @staticmethod
+    def start_command_count_flusher(
+        interval: float = command_count_flush_interval,
+    ) -> None:
+        task = DatabaseUtils._command_count_flush_task
+        if task is not None and not task.done():
+            return
+
+        DatabaseUtils._command_count_flush_task = asyncio.create_task(
+            DatabaseUtils._command_count_flush_loop(interval)
+        )
+
+    @staticmethod
+    async def stop_command_count_flusher() -> None:
+        """
+        Stops the periodic flush and persists whatever is still buffered
+        """
+
+        task = DatabaseUtils._command_count_flush_task
+        DatabaseUtils._command_count_flush_task = None
+
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        await DatabaseUtils.flush_command_counts()
+
+
+InvalidationBus.subscribe(DatabaseUtils._guild_cache)
@@ -3,11 +3,20 @@ from dotenv import load_dotenv
 from os import getenv
 from typing import Optional
 
+from db.profiles import DEFAULT_STORAGE_PROFILE, STORAGE_PROFILES
+from utils.gateway import DEFAULT_GATEWAY_PROFILE, GATEWAY_PROFILES
+
 
 @dataclass
 class EnvConfig:
     BOT_TOKEN: str
     DEBUG_CHANNEL_ID: Optional[int]
+    DB_PROFILE: str
+    GATEWAY_PROFILE: str
+    METRICS_FILE: Optional[str]
+    SHARDED: bool
+    SHARD_COUNT: Optional[int]
+    CLUSTER_PROCESSES: int
 
     @classmethod
     def from_env(cls) -> "EnvConfig":
@@ -28,4 +37,57 @@ class EnvConfig:
         else:
             print("DEBUG_CHANNEL_ID is not set. Debug logs will be disabled")
 
-        return cls(BOT_TOKEN=bot_token, DEBUG_CHANNEL_ID=debug_channel_id)
+        db_profile: str = getenv("DB_PROFILE") or DEFAULT_STORAGE_PROFILE
+        if db_profile not in STORAGE_PROFILES:
+            raise ValueError(
+                f"DB_PROFILE must be one of: {', '.join(STORAGE_PROFILES.keys())}"
+            )
+
+        gateway_profile: str = getenv("GATEWAY_PROFILE") or DEFAULT_GATEWAY_PROFILE
+        if gateway_profile not in GATEWAY_PROFILES:
+            raise ValueError(
+                f"GATEWAY_PROFILE must be one of: {', '.join(GATEWAY_PROFILES.keys())}"
+            )
+
+        metrics_file: Optional[str] = getenv("METRICS_FILE") or None
+
+        shard_count: Optional[int] = None
+        cluster_processes = 1
+        try:
+            if shard_count_str := getenv("SHARD_COUNT"):
+                shard_count = int(shard_count_str)
+            if cluster_processes_str := getenv("CLUSTER_PROCESSES"):
+                cluster_processes = int(cluster_processes_str)
+        except ValueError:
+            raise ValueError("SHARD_COUNT and CLUSTER_PROCESSES must be valid integers")
+
+        if shard_count is not None and shard_count < 1:
+            raise ValueError("SHARD_COUNT must be at least 1")
+        if cluster_processes < 1:
+            raise ValueError("CLUSTER_PROCESSES must be at least 1")
+        if shard_count is not None and cluster_processes > shard_count:
+            raise ValueError("CLUSTER_PROCESSES cannot exceed SHARD_COUNT")
+
+        # running several processes implies sharding, each process owns shards
+        sharded = (getenv("SHARDED") or "").lower() in ("1", "true", "yes")
+        sharded = sharded or cluster_processes > 1
+
+        # processes share the database file, which needs WAL and a busy timeout
+        pragmas = STORAGE_PROFILES[db_profile].pragmas
+        if cluster_processes > 1 and (
+            pragmas.get("journal_mode") != "WAL" or "busy_timeout" not in pragmas
+        ):
+            raise ValueError(
+                "CLUSTER_PROCESSES > 1 needs a DB_PROFILE using WAL with a busy_timeout"
+            )
+
+        return cls(
+            BOT_TOKEN=bot_token,
+            DEBUG_CHANNEL_ID=debug_channel_id,
+            DB_PROFILE=db_profile,
+            GATEWAY_PROFILE=gateway_profile,
+            METRICS_FILE=metrics_file,
+            SHARDED=sharded,
+            SHARD_COUNT=shard_count,
+            CLUSTER_PROCESSES=cluster_processes,
+        )
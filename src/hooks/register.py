@@ -1,16 +1,16 @@
 from discord.ext import commands
-from db.utils import DatabaseUtils as DBUtils
+from utils.tracing import Tracing
 
 
 async def register_hook_command(ctx: commands.Context) -> None:
+    # imported on first use, the database layer loads after startup
+    from db.utils import DatabaseUtils as DBUtils
+
     author_id = str(ctx.author.id)
     guild_id = str(ctx.guild.id) if ctx.guild else None
 
-    await DBUtils.fetch_or_create_user(author_id)
-
-    if guild_id is not None:
-        await DBUtils.fetch_or_create_guild(guild_id)
-        await DBUtils.fetch_or_create_guild_user_profile(guild_id, author_id)
+    with Tracing.span("hook"):
+        await DBUtils.register(guild_id, author_id)
 
 
 def register_hook():
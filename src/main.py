@@ -1,73 +1,259 @@
+# imported first so the imports below are part of the startup profile
+from utils.startup import StartupProfiler
+
 import discord
 from discord.ext import commands
 
+import argparse
 import asyncio
+import importlib
 from math import ceil
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Final, List, Optional, Union
 
-from db.engine import init_db
-from db.models import CommandCategory
-from db.utils import DatabaseUtils
 from env import EnvConfig
 from hooks.register import register_hook
+from utils.context import TracedContext
+from utils.gateway import GATEWAY_PROFILES
+from utils.metrics import Metrics
+from utils.tracing import Tracing
 
 environment = EnvConfig.from_env()
 
+cogs_path: Final[Path] = Path(__file__).resolve().parent / "cogs"
 
-async def setup_bot() -> commands.Bot:
-    await init_db()
+# top level commands of extensions loaded on their first use, extensions not
+# listed here are loaded at startup
+LAZY_COMMANDS: Final[Dict[str, str]] = {
+    "guild": "cogs.guild_setup.cog",
+    "rule34": "cogs.rule34.cog",
+    "r34": "cogs.rule34.cog",
+    "stats": "cogs.stats.cog",
+}
 
-    client = commands.Bot(
-        command_prefix=">>", help_command=None, intents=discord.Intents.all()
-    )
+
+async def setup_storage() -> None:
+    """
+    Imports the database layer and prepares the database, runs alongside the
+    gateway login
+    """
+
+    with StartupProfiler.background("storage imports"):
+        # sqlalchemy and sqlmodel take a while to import, keep the loop free
+        await asyncio.to_thread(importlib.import_module, "db.utils")
+
+    from db.engine import init_db
+    from db.invalidation import InvalidationBus
+    from db.utils import DatabaseUtils
+
+    with StartupProfiler.background("storage init"):
+        await init_db(environment.DB_PROFILE)
+
+    DatabaseUtils.start_command_count_flusher()
+    if environment.CLUSTER_PROCESSES > 1:
+        # other cluster processes change the rows our caches hold
+        await InvalidationBus.start()
+
+
+async def teardown_storage() -> None:
+    from db.invalidation import InvalidationBus
+    from db.utils import DatabaseUtils
+
+    await InvalidationBus.stop()
+    await DatabaseUtils.stop_command_count_flusher()
+
+
+def metrics_path(cluster_id: Optional[int]) -> Optional[Path]:
+    if not environment.METRICS_FILE:
+        return None
+
+    path = Path(environment.METRICS_FILE)
+    if cluster_id is None:
+        return path
+
+    # one file per cluster process, e.g. bot.prom -> bot.cluster0.prom
+    Metrics.labels["cluster"] = str(cluster_id)
+    return path.with_name(f"{path.stem}.cluster{cluster_id}{path.suffix}")
+
+
+async def setup_bot(
+    shard_ids: Optional[List[int]] = None,
+    shard_count: Optional[int] = None,
+    cluster_id: Optional[int] = None,
+    storage: Optional["asyncio.Task[None]"] = None,
+) -> Union[commands.Bot, commands.AutoShardedBot]:
+    """
+    Builds the client, commands wait for `storage` to finish before running
+    """
+
+    if (path := metrics_path(cluster_id)) is not None:
+        Metrics.start_file_writer(path)
+
+    gateway_options = GATEWAY_PROFILES[environment.GATEWAY_PROFILE].client_options()
+
+    client: Union[commands.Bot, commands.AutoShardedBot]
+    if environment.SHARDED:
+        # shard_ids of None lets the bot run every shard in this process
+        client = commands.AutoShardedBot(
+            command_prefix=">>",
+            help_command=None,
+            shard_ids=shard_ids,
+            shard_count=shard_count or environment.SHARD_COUNT,
+            **gateway_options,
+        )
+    else:
+        client = commands.Bot(command_prefix=">>", help_command=None, **gateway_options)
 
     client.before_invoke(register_hook())
 
     @client.event
     async def on_ready() -> None:
+        login_message = f"Logged in as {client.user}"
+        if cluster_id is not None:
+            login_message += f" (cluster {cluster_id}, shards {shard_ids})"
+
         if environment.DEBUG_CHANNEL_ID:
             channel = await client.fetch_channel(environment.DEBUG_CHANNEL_ID)
 
             if isinstance(channel, discord.TextChannel):
-                await channel.send(f"## Logged in as {client.user}")
+                await channel.send(f"## {login_message}")
             else:
                 raise TypeError("DEBUG_CHANNEL_ID does not point to a text channel")
 
-        print(f"Logged in as {client.user}")
+        print(login_message)
+
+        StartupProfiler.mark("gateway")
+        if (report := StartupProfiler.report()) is not None:
+            print(report)
+
+    @client.event
+    async def on_message(message: discord.Message) -> None:
+        if message.author.bot:
+            return
+
+        ctx = await client.get_context(message, cls=TracedContext)
+        if ctx.prefix is not None and storage is not None:
+            await storage
+
+        if ctx.command is None and ctx.invoked_with in LAZY_COMMANDS:
+            extension = LAZY_COMMANDS[ctx.invoked_with]
+            if extension not in client.extensions:
+                client.load_extension(extension)
+            ctx = await client.get_context(message, cls=TracedContext)
+
+        if ctx.command is None:
+            # unknown commands still go through invoke to dispatch their error
+            await client.invoke(ctx)
+            return
+
+        with Tracing.command(ctx.command.qualified_name):
+            await client.invoke(ctx)
+
+    # lives here rather than in the guild cog, which is only loaded on demand
+    @client.event
+    async def on_guild_join(guild: discord.Guild) -> None:
+        if storage is not None:
+            await storage
+
+        from db.utils import DatabaseUtils
+
+        await DatabaseUtils.create_guild(guild_id=str(guild.id))
 
     # TEST command
     @client.command()
     async def ping(ctx: commands.Context) -> None:
+        from db.models import CommandCategory
+        from db.utils import DatabaseUtils
+
         await ctx.reply(f"pong!\n> `Client Latency > {ceil(client.latency * 100)}ms`")
 
         guild: Optional[discord.Guild] = ctx.guild
         if guild:
             await DatabaseUtils.increment_command_count(
-                str(ctx.guild.id), str(ctx.author.id), CommandCategory.MISC
+                str(guild.id), str(ctx.author.id), CommandCategory.MISC
             )
 
-    # load up cogs
-    cogs_path = Path("src/cogs")
+    # load up cogs that are not loaded on demand
+    lazy_extensions = set(LAZY_COMMANDS.values())
     for folder in cogs_path.iterdir():
         if not folder.is_dir():
             continue
 
         for file in folder.glob("*cog.py"):
             module = f"cogs.{folder.name}.{file.stem}"
-            client.load_extension(module)
+            if module not in lazy_extensions:
+                client.load_extension(module)
 
     return client
 
 
-async def main():
-    client = await setup_bot()
+async def close_client(client: Union[commands.Bot, commands.AutoShardedBot]) -> None:
+    """
+    Unloads the extensions, waits for their cogs to release their resources in
+    the task they leave in `closing` and closes the client. Bot.close does not
+    unload extensions itself on py-cord
+    """
+
+    cogs = list(client.cogs.values())
+    for extension in tuple(client.extensions):
+        client.unload_extension(extension)
+
+    for cog in cogs:
+        closing: Optional["asyncio.Task[None]"] = getattr(cog, "closing", None)
+        if closing is not None:
+            await closing
+
+    await client.close()
+
+
+async def main(
+    shard_ids: Optional[List[int]] = None,
+    shard_count: Optional[int] = None,
+    cluster_id: Optional[int] = None,
+):
+    StartupProfiler.mark("imports")
+
+    storage = asyncio.create_task(setup_storage())
+    client = await setup_bot(shard_ids, shard_count, cluster_id, storage)
+    StartupProfiler.mark("client")
+
+    closing: Optional["asyncio.Task[None]"] = None
+
+    def close_on_failure(task: "asyncio.Task[None]") -> None:
+        nonlocal closing
+        if not task.cancelled() and task.exception() is not None:
+            closing = asyncio.create_task(close_client(client))
+
+    storage.add_done_callback(close_on_failure)
 
     try:
         await client.start(environment.BOT_TOKEN)
-    except KeyboardInterrupt:
-        await client.close()
+    finally:
+        # also reached on failed logins and cancellation by the cluster launcher,
+        # cogs have to be closed before the storage they write to is torn down
+        if closing is not None:
+            await closing
+        else:
+            await close_client(client)
+        await Metrics.stop_file_writer()
+
+        if not storage.done():
+            storage.cancel()
+        elif not storage.cancelled() and storage.exception() is None:
+            await teardown_storage()
+
+    # the bot cannot serve commands without its database
+    if storage.done() and not storage.cancelled() and (error := storage.exception()):
+        raise error
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="print how long each startup phase took once the bot is ready",
+    )
+    StartupProfiler.enabled = parser.parse_args().profile_startup
+
     asyncio.run(main())
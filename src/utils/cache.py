@@ -0,0 +1,227 @@
+import asyncio
+import time
+import weakref
+from cachetools import LRUCache, TLRUCache, TTLCache
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Final,
+    Generic,
+    Hashable,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class _InstrumentedCache(Generic[K, V]):
+    """
+    Counts lookups through `get`, evictions of live entries made room for by
+    `popitem`, and entries dropped by `expire`. Internal checks go through
+    `peek`, `in` or indexing, which are not counted
+    """
+
+    stats: CacheStats
+
+    def get(self, key: K, default: Any = None) -> Any:
+        if key in self:  # type: ignore[operator]
+            self.stats.hits += 1
+            return self[key]  # type: ignore[index]
+
+        self.stats.misses += 1
+        return default
+
+    def peek(self, key: K) -> Optional[V]:
+        try:
+            return self[key]  # type: ignore[index]
+        except KeyError:
+            return None
+
+    def popitem(self) -> Tuple[Any, Any]:
+        item = super().popitem()  # type: ignore[misc]
+        self.stats.evictions += 1
+        return item
+
+    def expire(self, time: Optional[float] = None) -> List[Tuple[Any, Any]]:
+        expired = super().expire(time)  # type: ignore[misc]
+        self.stats.expirations += len(expired)
+        return expired
+
+
+class InstrumentedLRUCache(_InstrumentedCache[K, V], LRUCache[K, V]):
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.stats = CacheStats()
+
+    def expire(self, time: Optional[float] = None) -> List[Tuple[Any, Any]]:
+        # entries never expire, they are only evicted
+        return []
+
+
+class InstrumentedTTLCache(_InstrumentedCache[K, V], TTLCache[K, V]):
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.stats = CacheStats()
+
+
+class InstrumentedTLRUCache(_InstrumentedCache[K, V], TLRUCache[K, V]):
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.stats = CacheStats()
+
+
+# every named cache of the process, read by the stats command and the metrics file
+CACHE_REGISTRY: Final[Dict[str, _InstrumentedCache]] = {}
+
+
+def register_cache(name: str, cache: _InstrumentedCache) -> None:
+    CACHE_REGISTRY[name] = cache
+
+
+def cache_snapshot() -> List[Tuple[str, CacheStats, int, int]]:
+    """
+    Name, stats, current size and maxsize of every registered cache, expired
+    entries are dropped first so the sizes only count live entries
+    """
+
+    snapshot = []
+    for name, cache in sorted(CACHE_REGISTRY.items()):
+        cache.expire()
+        snapshot.append((name, cache.stats, len(cache), cache.maxsize))  # type: ignore
+    return snapshot
+
+
+class AsyncCache(Generic[K, V]):
+    """
+    Size and ttl bounded cache shared between coroutines. Hits never wait, a
+    miss locks only its own key so concurrent misses of a key share one load
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int,
+        ttl: Optional[float] = None,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._cache: InstrumentedTTLCache[K, V] | InstrumentedLRUCache[K, V] = (
+            InstrumentedTTLCache(maxsize, ttl, timer)
+            if ttl is not None
+            else InstrumentedLRUCache(maxsize)
+        )
+        register_cache(name, self._cache)
+        self._locks: "weakref.WeakValueDictionary[K, asyncio.Lock]" = (
+            weakref.WeakValueDictionary()
+        )
+
+        # keys being loaded, flagged once written meanwhile so the load that
+        # raced the write is not cached
+        self._loading: Dict[K, bool] = {}
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def __contains__(self, key: K) -> bool:
+        return self._cache.peek(key) is not None
+
+    @property
+    def stats(self) -> CacheStats:
+        return self._cache.stats
+
+    def get(self, key: K) -> Optional[V]:
+        """
+        Looks the key up, counted as a hit or a miss
+        """
+
+        return self._cache.get(key)
+
+    def _written(self, key: K) -> None:
+        if key in self._loading:
+            self._loading[key] = True
+
+    def set(self, key: K, value: V) -> None:
+        self._written(key)
+        self._cache[key] = value
+
+    def update(self, key: K, mutate: Callable[[V], None]) -> None:
+        """
+        Mutates the cached value in place if the key is cached
+        """
+
+        self._written(key)
+        if key in self._cache:
+            mutate(self._cache[key])
+
+    def invalidate(self, key: K) -> None:
+        self._written(key)
+        self._cache.pop(key, None)
+
+    def clear(self) -> None:
+        for key in self._loading:
+            self._loading[key] = True
+        self._cache.clear()
+
+    @asynccontextmanager
+    async def lock(self, key: K) -> AsyncIterator[None]:
+        """
+        Per-key lock, dropped again once nobody holds or waits on it
+        """
+
+        if (lock := self._locks.get(key)) is None:
+            lock = self._locks[key] = asyncio.Lock()
+
+        async with lock:
+            yield
+
+    async def get_or_load(
+        self, key: K, loader: Callable[[], Awaitable[Optional[V]]]
+    ) -> Optional[V]:
+        """
+        Returns the cached value or loads it, a None result is not cached
+        """
+
+        if (value := self._cache.get(key)) is not None:
+            return value
+
+        async with self.lock(key):
+            # another waiter may have loaded the key meanwhile
+            if (value := self._cache.peek(key)) is not None:
+                return value
+
+            # the key lock makes this the only load of the key in flight
+            self._loading[key] = False
+            try:
+                value = await loader()
+            finally:
+                raced = self._loading.pop(key)
+
+            if value is not None and not raced:
+                self._cache[key] = value
+
+            return value
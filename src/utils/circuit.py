@@ -0,0 +1,90 @@
+import time
+from typing import Callable, Dict, Final, List, Tuple
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a failing dependency. After `failure_threshold` consecutive
+    failures the circuit opens and rejects calls, once `reset_timeout` passed a
+    single probe is let through (half open) whose outcome closes the circuit or
+    opens it again
+    """
+
+    CLOSED: Final[str] = "closed"
+    OPEN: Final[str] = "open"
+    HALF_OPEN: Final[str] = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        reset_timeout: float,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+
+        self._timer = timer
+        # when the circuit opened or, while half open, when the probe was sent
+        self._opened_at = 0.0
+
+        register_breaker(name, self)
+
+    def before_call(self) -> None:
+        """
+        Raises CircuitOpen unless the call may go through
+        """
+
+        if self.state == self.CLOSED:
+            return
+
+        now = self._timer()
+        if now - self._opened_at < self.reset_timeout:
+            raise CircuitOpen(f"{self.name} is unavailable")
+
+        # a probe that never reported back is replaced after another timeout
+        self.state = self.HALF_OPEN
+        self._opened_at = now
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        # calls started before the circuit opened have nothing left to say
+        if self.state == self.OPEN:
+            return
+
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.failures = 0
+            self.trips += 1
+            self._opened_at = self._timer()
+
+
+# every named breaker of the process, read by the metrics file
+BREAKER_REGISTRY: Final[Dict[str, CircuitBreaker]] = {}
+
+
+def register_breaker(name: str, breaker: CircuitBreaker) -> None:
+    BREAKER_REGISTRY[name] = breaker
+
+
+def breaker_snapshot() -> List[Tuple[str, str, int]]:
+    """
+    Name, state and number of trips of every registered breaker
+    """
+
+    return [
+        (name, breaker.state, breaker.trips)
+        for name, breaker in sorted(BREAKER_REGISTRY.items())
+    ]
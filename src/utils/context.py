@@ -0,0 +1,17 @@
+from discord.ext import commands
+
+from utils.tracing import Tracing
+
+
+class TracedContext(commands.Context):
+    """
+    Command context that times sending the command's responses
+    """
+
+    async def send(self, *args, **kwargs):
+        with Tracing.span("reply"):
+            return await super().send(*args, **kwargs)
+
+    async def reply(self, *args, **kwargs):
+        with Tracing.span("reply"):
+            return await super().reply(*args, **kwargs)
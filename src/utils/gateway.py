@@ -0,0 +1,60 @@
+import discord
+from dataclasses import dataclass
+from typing import Any, Dict, Final, Optional
+
+
+@dataclass(frozen=True)
+class GatewayProfile:
+    """
+    Gateway intents plus what the client caches of the events they deliver
+    """
+
+    name: str
+    # None requests every intent, otherwise only the named ones
+    intents: Optional[frozenset[str]] = None
+    cache_members: bool = True
+    chunk_guilds_at_startup: bool = True
+    max_messages: Optional[int] = 1000
+
+    def build_intents(self) -> discord.Intents:
+        if self.intents is None:
+            return discord.Intents.all()
+        return discord.Intents(**{intent: True for intent in self.intents})
+
+    def client_options(self) -> Dict[str, Any]:
+        """
+        Keyword arguments for the bot constructor
+        """
+
+        intents = self.build_intents()
+        member_cache_flags = (
+            discord.MemberCacheFlags.from_intents(intents)
+            if self.cache_members
+            else discord.MemberCacheFlags.none()
+        )
+
+        return {
+            "intents": intents,
+            "member_cache_flags": member_cache_flags,
+            "chunk_guilds_at_startup": self.chunk_guilds_at_startup,
+            "max_messages": self.max_messages,
+        }
+
+
+GATEWAY_PROFILES: Final[Dict[str, GatewayProfile]] = {
+    # every intent, every member and presence cached, guilds chunked on connect
+    "full": GatewayProfile(name="full"),
+    # what the prefix commands need: guild events and message content. Authors
+    # arrive with their messages, so members are neither cached nor chunked
+    "lean": GatewayProfile(
+        name="lean",
+        intents=frozenset(
+            {"guilds", "guild_messages", "dm_messages", "message_content"}
+        ),
+        cache_members=False,
+        chunk_guilds_at_startup=False,
+        max_messages=100,
+    ),
+}
+
+DEFAULT_GATEWAY_PROFILE: Final[str] = "full"
@@ -0,0 +1,234 @@
+import asyncio
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Final, List, Optional, Tuple
+
+from utils.circuit import CircuitBreaker, breaker_snapshot
+from utils.ratelimit import LimiterStats, limiter_snapshot
+from utils.tracing import LatencyHistogram, Tracing
+
+if TYPE_CHECKING:
+    # utils.cache pulls in cachetools, which startup leaves to the storage task
+    from utils.cache import CacheStats
+
+CacheMetric = Tuple[str, str, str, Callable[["CacheStats", int, int], float]]
+LimiterMetric = Tuple[str, str, str, Callable[[LimiterStats, int], float]]
+
+
+class Metrics:
+    PREFIX: Final[str] = "evelynn"
+    file_interval: Final[int] = 15
+
+    CACHE_METRICS: Final[List[CacheMetric]] = [
+        (
+            "cache_hits_total",
+            "counter",
+            "Lookups answered from the cache",
+            lambda stats, size, maxsize: stats.hits,
+        ),
+        (
+            "cache_misses_total",
+            "counter",
+            "Lookups not found in the cache",
+            lambda stats, size, maxsize: stats.misses,
+        ),
+        (
+            "cache_evictions_total",
+            "counter",
+            "Live entries evicted to make room for new ones",
+            lambda stats, size, maxsize: stats.evictions,
+        ),
+        (
+            "cache_expirations_total",
+            "counter",
+            "Entries dropped after their ttl ran out",
+            lambda stats, size, maxsize: stats.expirations,
+        ),
+        (
+            "cache_size",
+            "gauge",
+            "Entries currently held",
+            lambda stats, size, maxsize: size,
+        ),
+        (
+            "cache_maxsize",
+            "gauge",
+            "Configured entry limit",
+            lambda stats, size, maxsize: maxsize,
+        ),
+    ]
+
+    LIMITER_METRICS: Final[List[LimiterMetric]] = [
+        (
+            "ratelimit_admitted_total",
+            "counter",
+            "Requests let through by the limiter",
+            lambda stats, queued: stats.admitted,
+        ),
+        (
+            "ratelimit_rejected_total",
+            "counter",
+            "Requests rejected because the queues were full",
+            lambda stats, queued: stats.rejected,
+        ),
+        (
+            "ratelimit_queued",
+            "gauge",
+            "Requests currently waiting for a token",
+            lambda stats, queued: queued,
+        ),
+    ]
+
+    # labels added to every sample, e.g. the cluster of a sharded deployment
+    labels: Final[Dict[str, str]] = {}
+
+    _file_task: Optional[asyncio.Task[None]] = None
+
+    @staticmethod
+    def _labels(**labels: str) -> str:
+        merged = {**Metrics.labels, **labels}
+        return ",".join(f'{key}="{value}"' for key, value in merged.items())
+
+    @staticmethod
+    def render() -> str:
+        """
+        Renders every metric in the Prometheus text exposition format
+        """
+
+        from utils.cache import cache_snapshot
+
+        snapshot = cache_snapshot()
+        lines: List[str] = []
+
+        for name, kind, description, value in Metrics.CACHE_METRICS:
+            metric = f"{Metrics.PREFIX}_{name}"
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for cache, stats, size, maxsize in snapshot:
+                labels = Metrics._labels(cache=cache)
+                lines.append(f"{metric}{{{labels}}} {value(stats, size, maxsize)}")
+
+        lines.extend(Metrics._render_latencies())
+        lines.extend(Metrics._render_limiters())
+        lines.extend(Metrics._render_breakers())
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_latencies() -> List[str]:
+        metric = f"{Metrics.PREFIX}_command_span_seconds"
+        lines = [
+            f"# HELP {metric} Latency of commands and of the spans within them",
+            f"# TYPE {metric} histogram",
+        ]
+
+        for command, span, histogram in Tracing.snapshot():
+            labels = Metrics._labels(command=command, span=span)
+            lines.extend(Metrics._render_histogram(metric, labels, histogram))
+
+        return lines
+
+    @staticmethod
+    def _render_histogram(
+        metric: str, labels: str, histogram: LatencyHistogram
+    ) -> List[str]:
+        lines = []
+
+        cumulative = 0
+        for bound, count in zip(histogram.BUCKETS, histogram.counts):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{{labels},le="{bound:.6g}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+        lines.append(f"{metric}_sum{{{labels}}} {histogram.sum}")
+        lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+
+        return lines
+
+    @staticmethod
+    def _render_limiters() -> List[str]:
+        snapshot = limiter_snapshot()
+        lines: List[str] = []
+
+        for name, kind, description, value in Metrics.LIMITER_METRICS:
+            metric = f"{Metrics.PREFIX}_{name}"
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for limiter, stats, queued in snapshot:
+                labels = Metrics._labels(limiter=limiter)
+                lines.append(f"{metric}{{{labels}}} {value(stats, queued)}")
+
+        metric = f"{Metrics.PREFIX}_ratelimit_wait_seconds"
+        lines.append(f"# HELP {metric} Time requests waited for a token")
+        lines.append(f"# TYPE {metric} histogram")
+        for limiter, stats, _ in snapshot:
+            labels = Metrics._labels(limiter=limiter)
+            lines.extend(Metrics._render_histogram(metric, labels, stats.wait))
+
+        return lines
+
+    @staticmethod
+    def _render_breakers() -> List[str]:
+        snapshot = breaker_snapshot()
+
+        open_metric = f"{Metrics.PREFIX}_circuit_open"
+        trips_metric = f"{Metrics.PREFIX}_circuit_trips_total"
+        lines = [
+            f"# HELP {open_metric} Whether the circuit currently rejects calls",
+            f"# TYPE {open_metric} gauge",
+        ]
+        for breaker, state, _ in snapshot:
+            labels = Metrics._labels(breaker=breaker)
+            is_open = int(state != CircuitBreaker.CLOSED)
+            lines.append(f"{open_metric}{{{labels}}} {is_open}")
+
+        lines.append(f"# HELP {trips_metric} Times the circuit opened")
+        lines.append(f"# TYPE {trips_metric} counter")
+        for breaker, _, trips in snapshot:
+            labels = Metrics._labels(breaker=breaker)
+            lines.append(f"{trips_metric}{{{labels}}} {trips}")
+
+        return lines
+
+    @staticmethod
+    def _write_file(path: Path, content: str) -> None:
+        # write then rename so scrapers never read a half written file
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        tmp_path.write_text(content)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    async def write_file(path: Path) -> None:
+        await asyncio.to_thread(Metrics._write_file, path, Metrics.render())
+
+    @staticmethod
+    async def _file_loop(path: Path, interval: float) -> None:
+        while True:
+            try:
+                await Metrics.write_file(path)
+            except OSError as e:
+                print(f"Failed to write metrics file: {e}")
+            await asyncio.sleep(interval)
+
+    @staticmethod
+    def start_file_writer(path: Path, interval: float = file_interval) -> None:
+        """
+        Periodically writes the metrics to `path`, e.g. for node_exporter's
+        textfile collector
+        """
+
+        task = Metrics._file_task
+        if task is not None and not task.done():
+            return
+
+        Metrics._file_task = asyncio.create_task(Metrics._file_loop(path, interval))
+
+    @staticmethod
+    async def stop_file_writer() -> None:
+        task = Metrics._file_task
+        Metrics._file_task = None
+
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
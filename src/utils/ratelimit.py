@@ -0,0 +1,152 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Final, List, Optional, Tuple
+
+from utils.tracing import LatencyHistogram, Tracing
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+@dataclass
+class LimiterStats:
+    admitted: int = 0
+    rejected: int = 0
+    wait: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+
+class FairRateLimiter:
+    """
+    Token bucket shared by many flows (e.g. guilds). Callers that find no token
+    queue per flow and are admitted round-robin across flows, so one busy flow
+    cannot starve the others. Full queues reject new callers immediately
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: int,
+        max_queue_depth: int,
+        max_flow_queue_depth: int,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_queue_depth = max_queue_depth
+        self.max_flow_queue_depth = max_flow_queue_depth
+        self.stats = LimiterStats()
+
+        self._timer = timer
+        self._tokens = float(burst)
+        self._updated = timer()
+
+        self._queues: Dict[str, Deque[asyncio.Future[None]]] = {}
+        # flows with waiters, in the order they are served next
+        self._order: Deque[str] = deque()
+        self._queued = 0
+        self._dispatcher: Optional[asyncio.Task[None]] = None
+
+        register_limiter(name, self)
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def _refill(self) -> None:
+        now = self._timer()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _dequeue(self, flow: str, future: "asyncio.Future[None]") -> None:
+        queue = self._queues[flow]
+        queue.remove(future)
+        self._queued -= 1
+        if not queue:
+            del self._queues[flow]
+            self._order.remove(flow)
+
+    async def acquire(self, flow: str) -> None:
+        """
+        Waits for a token on behalf of `flow`, raises RateLimitExceeded when
+        the queues are full
+        """
+
+        self._refill()
+        if not self._queued and self._tokens >= 1:
+            self._tokens -= 1
+            self.stats.admitted += 1
+            self.stats.wait.observe(0.0)
+            return
+
+        queue = self._queues.get(flow)
+        if self._queued >= self.max_queue_depth or (
+            queue is not None and len(queue) >= self.max_flow_queue_depth
+        ):
+            self.stats.rejected += 1
+            raise RateLimitExceeded(f"{self.name} is saturated")
+
+        if queue is None:
+            queue = self._queues[flow] = deque()
+            self._order.append(flow)
+
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        queue.append(future)
+        self._queued += 1
+
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        start = time.perf_counter()
+        try:
+            with Tracing.span("rate_limit"):
+                await future
+        except asyncio.CancelledError:
+            # still queued unless the dispatcher got to it first
+            if future in self._queues.get(flow, ()):
+                self._dequeue(flow, future)
+            raise
+
+        self.stats.admitted += 1
+        self.stats.wait.observe(time.perf_counter() - start)
+
+    async def _dispatch(self) -> None:
+        while self._order:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+
+            flow = self._order[0]
+            self._dequeue(flow, future := self._queues[flow][0])
+            if flow in self._queues:
+                # the flow keeps its remaining waiters but goes to the back
+                self._order.rotate(-1)
+
+            # waiters cancelled since are dropped without spending a token
+            if not future.cancelled():
+                self._tokens -= 1
+                future.set_result(None)
+
+
+# every named limiter of the process, read by the metrics file
+LIMITER_REGISTRY: Final[Dict[str, FairRateLimiter]] = {}
+
+
+def register_limiter(name: str, limiter: FairRateLimiter) -> None:
+    LIMITER_REGISTRY[name] = limiter
+
+
+def limiter_snapshot() -> List[Tuple[str, LimiterStats, int]]:
+    """
+    Name, stats and current queue depth of every registered limiter
+    """
+
+    return [
+        (name, limiter.stats, limiter.queued)
+        for name, limiter in sorted(LIMITER_REGISTRY.items())
+    ]
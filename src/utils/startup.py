@@ -0,0 +1,93 @@
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Final, Iterator, List, Optional, Tuple
+
+
+def process_age() -> Optional[float]:
+    """
+    Seconds since the process was started, read from /proc where available
+    """
+
+    try:
+        stat = Path("/proc/self/stat").read_text()
+        # fields after the parenthesised command name start at field 3
+        start_ticks = int(stat.rsplit(")", 1)[1].split()[19])
+        uptime = float(Path("/proc/uptime").read_text().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+
+
+class StartupProfiler:
+    """
+    Wall clock breakdown of startup, printed once the bot is ready when
+    enabled through --profile-startup. Phases are consecutive, work running
+    alongside them (e.g. storage setup during the gateway login) is timed
+    separately
+    """
+
+    enabled: bool = False
+
+    # consecutive phases, the first covers the interpreter up to this import
+    PHASES: Final[List[Tuple[str, float]]] = []
+    BACKGROUND: Final[List[Tuple[str, float]]] = []
+
+    _last: float = time.perf_counter()
+    _reported: bool = False
+
+    @staticmethod
+    def mark(phase: str) -> None:
+        """
+        Ends `phase`, which started where the previous phase ended. Ignored
+        once startup was reported, e.g. for on_ready after a reconnect
+        """
+
+        if StartupProfiler._reported:
+            return
+
+        now = time.perf_counter()
+        StartupProfiler.PHASES.append((phase, now - StartupProfiler._last))
+        StartupProfiler._last = now
+
+    @staticmethod
+    @contextmanager
+    def background(phase: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            StartupProfiler.BACKGROUND.append((phase, time.perf_counter() - start))
+
+    @staticmethod
+    def report() -> Optional[str]:
+        """
+        Ends startup and returns the breakdown, only the first time it is asked
+        for and only if enabled
+        """
+
+        if StartupProfiler._reported:
+            return None
+        StartupProfiler._reported = True
+
+        if not StartupProfiler.enabled:
+            return None
+
+        total = sum(seconds for _, seconds in StartupProfiler.PHASES)
+        lines = [f"{'startup phase':<22} {'ms':>9}"]
+        for phase, seconds in StartupProfiler.PHASES:
+            lines.append(f"{phase:<22} {seconds * 1000:>9.1f}")
+        lines.append(f"{'total':<22} {total * 1000:>9.1f}")
+
+        if StartupProfiler.BACKGROUND:
+            lines.append(f"\n{'in the background':<22} {'ms':>9}")
+            for phase, seconds in StartupProfiler.BACKGROUND:
+                lines.append(f"{phase:<22} {seconds * 1000:>9.1f}")
+
+        return "\n".join(lines)
+
+
+if (_age := process_age()) is not None:
+    StartupProfiler.PHASES.append(("interpreter", _age))
@@ -0,0 +1,125 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import Context, ContextVar, copy_context
+from typing import Dict, Final, Iterator, List, Optional, Tuple
+
+
+class LatencyHistogram:
+    """
+    Fixed bucket latency histogram, buckets grow by a factor of sqrt(2) from
+    0.25ms to ~46s so percentiles are estimated within ~20%
+    """
+
+    BUCKETS: Final[Tuple[float, ...]] = tuple(0.00025 * 2 ** (i / 2) for i in range(36))
+
+    def __init__(self) -> None:
+        # the extra last bucket counts observations above the largest bound
+        self.counts: List[int] = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(self.BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> float:
+        """
+        Estimates the q-th percentile (0-100) by interpolating inside the
+        bucket it falls into
+        """
+
+        if self.count == 0:
+            return 0.0
+
+        rank = q / 100 * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                if index == len(self.BUCKETS):
+                    return self.max
+
+                lower = self.BUCKETS[index - 1] if index > 0 else 0.0
+                upper = min(self.BUCKETS[index], self.max)
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+
+        return self.max
+
+
+class Tracing:
+    """
+    Per-command latency histograms, broken down into spans. The running command
+    is tracked through a context variable, so spans opened anywhere below the
+    command's task (hooks, database sessions, http requests) are attributed to
+    it
+    """
+
+    TOTAL_SPAN: Final[str] = "total"
+    # spans of tasks left running by commands, see background()
+    BACKGROUND_COMMAND: Final[str] = "background"
+
+    _command: ContextVar[Optional[str]] = ContextVar("traced_command", default=None)
+
+    # (command, span) -> histogram
+    HISTOGRAMS: Final[Dict[Tuple[str, str], LatencyHistogram]] = {}
+
+    @staticmethod
+    def observe(command: str, span: str, seconds: float) -> None:
+        key = (command, span)
+        if (histogram := Tracing.HISTOGRAMS.get(key)) is None:
+            histogram = Tracing.HISTOGRAMS[key] = LatencyHistogram()
+        histogram.observe(seconds)
+
+    @staticmethod
+    @contextmanager
+    def command(name: str) -> Iterator[None]:
+        """
+        Times a whole command invocation and attributes nested spans to it
+        """
+
+        token = Tracing._command.set(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            Tracing.observe(name, Tracing.TOTAL_SPAN, time.perf_counter() - start)
+            Tracing._command.reset(token)
+
+    @staticmethod
+    @contextmanager
+    def span(name: str) -> Iterator[None]:
+        """
+        Times a section of the running command, a no-op outside of commands
+        """
+
+        if (command := Tracing._command.get()) is None:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            Tracing.observe(command, name, time.perf_counter() - start)
+
+    @staticmethod
+    def background() -> Context:
+        """
+        Context for tasks a command starts without waiting for them, their spans
+        are recorded under the background command instead of the command's
+        """
+
+        context = copy_context()
+        context.run(Tracing._command.set, Tracing.BACKGROUND_COMMAND)
+        return context
+
+    @staticmethod
+    def snapshot() -> List[Tuple[str, str, LatencyHistogram]]:
+        return [
+            (command, span, histogram)
+            for (command, span), histogram in sorted(Tracing.HISTOGRAMS.items())
+        ]